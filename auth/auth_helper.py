@@ -1,10 +1,21 @@
-import json
+import hashlib
 
 from flask import jsonify
 from jose import jwt
-from six.moves.urllib.request import urlopen
 
+from auth.jwks_store import JwksStore
+from cache.lru_cache import LruCache
 from constants import constants
+from monitoring.timing import timed
+
+jwks_store = JwksStore(constants.JWKS_URL,
+                       ttl=constants.JWKS_CACHE_TTL,
+                       fetch_timeout=constants.JWKS_FETCH_TIMEOUT,
+                       min_refresh_interval=constants.JWKS_MIN_REFRESH_INTERVAL)
+
+# Payloads of tokens that passed verification, keyed by a hash of the token.
+# Entries expire at the token's exp claim. Rejected tokens are never cached.
+verified_token_cache = LruCache(constants.VERIFIED_TOKEN_CACHE_SIZE)
 
 
 class AuthError(Exception):
@@ -19,6 +30,7 @@ def handle_auth_error(ex):
     return response
 
 
+@timed("auth.verify_jwt")
 def verify_jwt(request):
     if 'Authorization' in request.headers:
         auth_header = request.headers['Authorization'].split()
@@ -28,8 +40,11 @@ def verify_jwt(request):
                          "description":
                              "Authorization header is missing"}, 401)
 
-    jsonurl = urlopen("https://" + constants.DOMAIN + "/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    payload = verified_token_cache.get(token_hash)
+    if payload is not None:
+        return payload
+
     try:
         unverified_header = jwt.get_unverified_header(token)
     except jwt.JWTError:
@@ -42,16 +57,7 @@ def verify_jwt(request):
                          "description":
                              "Invalid header. "
                              "Use an RS256 signed JWT Access Token"}, 401)
-    rsa_key = {}
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"]
-            }
+    rsa_key = get_rsa_key(unverified_header)
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -74,6 +80,8 @@ def verify_jwt(request):
                              "description":
                                  "Unable to parse authentication"
                                  " token."}, 401)
+        if "exp" in payload:
+            verified_token_cache.set(token_hash, payload, expires_at=payload["exp"])
         return payload
     else:
         raise AuthError({"code": "no_rsa_key",
@@ -81,20 +89,10 @@ def verify_jwt(request):
                              "No RSA key in JWKS"}, 401)
 
 
+@timed("auth.decode_token")
 def decode_auth_token(auth_token):
-    rsa_key = {}
     unverified_header = jwt.get_unverified_header(auth_token)
-    jsonurl = urlopen("https://" + constants.DOMAIN + "/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"]
-            }
+    rsa_key = get_rsa_key(unverified_header)
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -118,3 +116,13 @@ def decode_auth_token(auth_token):
                                  "Unable to parse authentication"
                                  " token."}, 401)
         return payload
+
+
+def get_rsa_key(unverified_header):
+    # Look up the signing key in the shared JWKS cache
+    try:
+        rsa_key = jwks_store.get_key(unverified_header.get("kid"))
+    except Exception:
+        raise AuthError({"code": "jwks_unavailable",
+                         "description": constants.jwks_unavailable_error}, 503)
+    return rsa_key or {}
@@ -0,0 +1,124 @@
+import json
+import logging
+import threading
+import time
+
+from six.moves.urllib.request import urlopen
+
+from monitoring.timing import span
+
+logger = logging.getLogger(__name__)
+
+
+class JwksUnavailableError(Exception):
+    pass
+
+
+class JwksStore:
+    """
+    Process-wide cache of the signing keys published at a JWKS endpoint.
+
+    Keys are parsed once and served from memory until the TTL expires. An expired
+    store keeps serving the current keys while a background thread refetches them.
+    An unknown kid forces one synchronous refresh (rate limited), and a failed
+    refresh keeps the stale keys instead of failing every request.
+
+    A cold store fetches at most once per min_refresh_interval. Requests that
+    arrive while that fetch is running wait for it, up to fetch_timeout.
+    Requests that arrive after it failed fail fast instead of fetching again.
+    """
+
+    def __init__(self, url, ttl, fetch_timeout, min_refresh_interval):
+        self.url = url
+        self.ttl = ttl
+        self.fetch_timeout = fetch_timeout
+        self.min_refresh_interval = min_refresh_interval
+
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        # Cold store, nothing to serve yet. Fetch synchronously, or wait for
+        # the fetch another thread is running.
+        if self._fetched_at is None:
+            if not self._can_force_refresh() and not self._lock.locked():
+                raise JwksUnavailableError("JWKS fetch from {0} failed recently".format(self.url))
+            self.refresh(timeout=self.fetch_timeout)
+            return self._keys.get(kid)
+
+        if time.monotonic() - self._fetched_at > self.ttl and self._can_force_refresh():
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._can_force_refresh():
+            # The identity provider may have rotated its keys
+            self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self, timeout=-1):
+        # A fetch already running on another thread is waited for, up to
+        # timeout seconds (forever by default)
+        requested_at = time.monotonic()
+        if not self._lock.acquire(timeout=timeout):
+            raise JwksUnavailableError("Timed out waiting for the JWKS fetch from {0}".format(self.url))
+        try:
+            # Another thread refreshed the keys while this one was waiting
+            if self._fetched_at is not None and self._fetched_at >= requested_at:
+                return
+            # or failed to fetch them into a cold store
+            if self._fetched_at is None and not self._can_force_refresh():
+                raise JwksUnavailableError("JWKS fetch from {0} failed recently".format(self.url))
+            self._last_attempt = time.monotonic()
+            try:
+                keys = self._fetch()
+            except Exception:
+                if self._fetched_at is None:
+                    raise
+                logger.warning("JWKS refresh from %s failed, serving stale keys", self.url, exc_info=True)
+                return
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_attempt = None
+
+    def _fetch(self):
+        with span("auth.jwks_fetch"):
+            jsonurl = urlopen(self.url, timeout=self.fetch_timeout)
+            jwks = json.loads(jsonurl.read())
+        keys = {}
+        for key in jwks["keys"]:
+            keys[key["kid"]] = {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key["use"],
+                "n": key["n"],
+                "e": key["e"]
+            }
+        return keys
+
+    def _can_force_refresh(self):
+        return self._last_attempt is None or time.monotonic() - self._last_attempt > self.min_refresh_interval
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="jwks-refresh", daemon=True).start()
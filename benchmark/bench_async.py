@@ -0,0 +1,73 @@
+"""
+Latency of the car routes on the sync path against the async path (ASYNC_VIEWS).
+
+Runs the routes through the Flask test client against the in-memory storage
+backend with a simulated Datastore round trip per RPC, so calls that overlap on
+the async path show up as saved latency. --verify-ms adds the cost of a token
+check that has to go to the network, e.g. a JWKS refresh.
+
+    python -m benchmark.bench_async --rtt-ms 5
+    python -m benchmark.bench_async --rtt-ms 5 --verify-ms 5
+"""
+import argparse
+import time
+from unittest import mock
+
+from benchmark.bench_routes import USER_ID, Fixture, measure
+from constants import constants
+from storage import backend
+from storage.memory_backend import MemoryClient
+
+SCENARIOS = {
+    "GET /cars": lambda f: ("GET", "/cars?limit=5", None),
+    "GET /cars?limit=100": lambda f: ("GET", "/cars?limit=100", None),
+    "GET /cars/<car_id>": lambda f: ("GET", "/cars/{0}".format(f.car_ids[0]), None),
+    "PUT /cars/<car_id>": lambda f: ("PUT", "/cars/{0}".format(f.car_ids[1]), f.car_body()),
+    "PATCH /cars/<car_id>": lambda f: ("PATCH", "/cars/{0}".format(f.car_ids[2]), {"color": f.unique_name()}),
+}
+
+
+def run(iterations, warmup, rtt, verify):
+    client = MemoryClient(rpc_latency=rtt)
+    backend.set_client(client)
+
+    from main import app
+    from service import async_car_service, car_service
+
+    fixture = Fixture(client, cars=100)
+    test_client = app.test_client()
+
+    def fake_verify_jwt(request):
+        time.sleep(verify)
+        return {"sub": USER_ID}
+
+    results = {}
+    with mock.patch.object(car_service, "verify_jwt", fake_verify_jwt), \
+            mock.patch.object(async_car_service, "verify_jwt", fake_verify_jwt):
+        for name, scenario in SCENARIOS.items():
+            for mode in (False, True):
+                with mock.patch.object(constants, "ASYNC_VIEWS", mode):
+                    results[name, mode] = measure(test_client, fixture, client, scenario, iterations, warmup)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--rtt-ms", type=float, default=5.0, help="simulated Datastore round trip per RPC")
+    parser.add_argument("--verify-ms", type=float, default=0.0, help="simulated token verification time")
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.warmup, args.rtt_ms / 1000, args.verify_ms / 1000)
+
+    print("{0:<24} {1:>12} {2:>12} {3:>9} {4:>6}".format("route", "sync p50", "async p50", "saved", "rpcs"))
+    for name in SCENARIOS:
+        sync, concurrent = results[name, False], results[name, True]
+        saved = (1 - concurrent["p50_ms"] / sync["p50_ms"]) * 100
+        print("{0:<24} {1:>9.2f} ms {2:>9.2f} ms {3:>8.0f}% {4:>6g}".format(
+            name, sync["p50_ms"], concurrent["p50_ms"], saved, concurrent["datastore_rpcs"]))
+
+
+if __name__ == '__main__':
+    main()
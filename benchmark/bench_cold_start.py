@@ -0,0 +1,92 @@
+"""
+Cold start cost of a new instance: the time to import main, and the latency of
+the first and second request, with and without a /_ah/warmup request first.
+
+Every sample runs in a fresh interpreter. The storage backend comes from
+STORAGE_BACKEND as in production ("memory" by default here), and verify_jwt is
+faked like in bench_routes. The default --jwks-url points at a closed local
+port, so the warmup's JWKS refresh fails fast and is only logged.
+
+    python -m benchmark.bench_cold_start --runs 10
+    STORAGE_BACKEND=datastore python -m benchmark.bench_cold_start --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def child(warmup):
+    # One cold start, timed from inside the new interpreter
+    start = time.perf_counter()
+    from main import app
+    imported = time.perf_counter()
+
+    from unittest import mock
+    from benchmark.bench_routes import JSON_HEADERS, USER_ID
+    from service import car_service
+
+    test_client = app.test_client()
+    result = {"import_ms": (imported - start) * 1000}
+    if warmup:
+        start = time.perf_counter()
+        test_client.get("/_ah/warmup")
+        result["warmup_ms"] = (time.perf_counter() - start) * 1000
+
+    with mock.patch.object(car_service, "verify_jwt", lambda request: {"sub": USER_ID}):
+        for name in ("first_ms", "second_ms"):
+            start = time.perf_counter()
+            response = test_client.get("/cars", headers=JSON_HEADERS)
+            response.get_data()
+            result[name] = (time.perf_counter() - start) * 1000
+            assert response.status_code == 200, response.status_code
+    print(json.dumps(result))
+
+
+def sample(warmup, env):
+    args = [sys.executable, "-m", "benchmark.bench_cold_start", "--child"] + (["--with-warmup"] if warmup else [])
+    output = subprocess.run(args, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--jwks-url", default="http://127.0.0.1:9/jwks.json",
+                        help="JWKS endpoint fetched by the warmup request")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--with-warmup", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if os.environ.get("BENCH_JWKS_URL"):
+            from constants import constants
+            constants.JWKS_URL = os.environ["BENCH_JWKS_URL"]
+            from auth.auth_helper import jwks_store
+            jwks_store.url = constants.JWKS_URL
+        child(args.with_warmup)
+        return
+
+    env = dict(os.environ, BENCH_JWKS_URL=args.jwks_url)
+    env.setdefault("STORAGE_BACKEND", "memory")
+    print("backend: {0}, {1} runs".format(env["STORAGE_BACKEND"], args.runs))
+    print("{0:<16} {1:>12} {2:>12} {3:>12} {4:>12}".format("mode", "import", "warmup", "1st request",
+                                                           "2nd request"))
+    for warmup in (False, True):
+        samples = [sample(warmup, env) for _ in range(args.runs)]
+
+        def p50(name):
+            if name not in samples[0]:
+                return "-"
+            return "{0:.1f} ms".format(statistics.median(s[name] for s in samples))
+
+        print("{0:<16} {1:>12} {2:>12} {3:>12} {4:>12}".format(
+            "with warmup" if warmup else "cold", p50("import_ms"), p50("warmup_ms"), p50("first_ms"),
+            p50("second_ms")))
+
+
+if __name__ == '__main__':
+    main()
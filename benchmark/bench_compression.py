@@ -0,0 +1,85 @@
+"""
+Bytes on the wire against CPU time for the compressed list and export routes.
+
+Fetches each route once through the Flask test client against the in-memory
+storage backend, then compresses its body the way compression_helper does:
+in one go for a JSON response, and chunk by chunk with a flush per chunk for
+an NDJSON stream. Reports the size and the CPU time per response for gzip and
+brotli at a few levels.
+
+    python -m benchmark.bench_compression
+    python -m benchmark.bench_compression --cars 200 --number 20
+"""
+import argparse
+import time
+from unittest import mock
+
+from benchmark.bench_routes import JSON_HEADERS, USER_ID, Fixture
+from constants import constants
+from service import compression_helper
+from storage import backend
+from storage.memory_backend import MemoryClient
+
+ROUTES = ["/cars?limit=100", "/spares?limit=100", "/users", "/cars/export", "/spares/export",
+          "/users?stream=true"]
+SETTINGS = [("gzip", 1), ("gzip", 6), ("gzip", 9), ("br", 1), ("br", 4), ("br", 11)]
+
+
+def fetch(test_client, route):
+    # The uncompressed body as the chunks the route produces
+    response = test_client.get(route, headers=dict(JSON_HEADERS, **{"Accept-Encoding": "identity"}))
+    assert response.status_code == 200, (route, response.status_code)
+    return list(response.response), response.is_streamed
+
+
+def compress(chunks, streamed, encoding):
+    if streamed:
+        return b"".join(compression_helper.compress_stream(iter(chunks), encoding))
+    compressor = compression_helper.make_compressor(encoding)
+    return compressor.compress(b"".join(chunks)) + compressor.finish()
+
+
+def measure(chunks, streamed, encoding, level, number):
+    setting = "BROTLI_QUALITY" if encoding == "br" else "COMPRESSION_LEVEL"
+    with mock.patch.object(constants, setting, level):
+        start = time.process_time()
+        for _ in range(number):
+            data = compress(chunks, streamed, encoding)
+        cpu = (time.process_time() - start) / number
+    return len(data), cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cars", type=int, default=100)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    client = MemoryClient()
+    backend.set_client(client)
+
+    from main import app
+    from service import car_service
+
+    Fixture(client, cars=args.cars, free_spares=args.cars, users=args.cars)
+    test_client = app.test_client()
+
+    settings = [(encoding, level) for encoding, level in SETTINGS
+                if encoding != "br" or compression_helper.brotli is not None]
+    if len(settings) < len(SETTINGS):
+        print("brotli is not installed, only gzip is measured")
+
+    print("{0:<20} {1:<8} {2:>10} {3:>7} {4:>9}".format("route", "encoding", "bytes", "ratio", "cpu ms"))
+    with mock.patch.object(car_service, "verify_jwt", return_value={"sub": USER_ID}):
+        for route in ROUTES:
+            chunks, streamed = fetch(test_client, route)
+            size = sum(len(chunk) for chunk in chunks)
+            print("{0:<20} {1:<8} {2:>10} {3:>7} {4:>9}".format(route, "identity", size, "1.00", "-"))
+            for encoding, level in settings:
+                compressed, cpu = measure(chunks, streamed, encoding, level, args.number)
+                print("{0:<20} {1:<8} {2:>10} {3:>7.2f} {4:>9.3f}".format(
+                    "", "{0}-{1}".format(encoding, level), compressed, compressed / size, cpu * 1000))
+
+
+if __name__ == '__main__':
+    main()
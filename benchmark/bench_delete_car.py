@@ -0,0 +1,97 @@
+"""
+Shows how DELETE /cars/<car_id> latency scales with the number of installed spares.
+
+Runs the real route through the Flask test client against the in-memory storage
+backend, with every RPC slowed down by a simulated round trip. The legacy column
+replays the old cascade (one put per spare) against the same data for comparison.
+
+    python -m benchmark.bench_delete_car --rtt-ms 2 --repeat 5
+"""
+import argparse
+import statistics
+import time
+from unittest import mock
+
+from google.cloud import datastore
+
+from storage import backend
+from storage.memory_backend import MemoryClient
+
+USER_ID = "bench-user"
+
+
+def seed_car(client, spare_count):
+    car = datastore.Entity(key=client.key("cars"))
+    car.update({"name": "car-{0}".format(time.perf_counter_ns()), "model": "m", "reg_num": "r", "color": "c",
+                "user_id": USER_ID})
+    client.put(car)
+
+    spares = []
+    for i in range(spare_count):
+        spare = datastore.Entity(key=client.key("spares"))
+        spare.update({"name": "spare-{0}".format(i), "price": 1.0, "serial_num": i, "car_id": car.key.id})
+        spares.append(spare)
+    client.put_multi(spares)
+    return car
+
+
+def legacy_delete(client, car):
+    spares_query = client.query(kind="spares")
+    spares_query.add_filter("car_id", "=", car.key.id)
+    for spare in list(spares_query.fetch()):
+        spare["car_id"] = None
+        client.put(spare)
+    client.delete(car.key)
+
+
+def run(spare_counts, repeat, rtt):
+    client = MemoryClient()
+    backend.set_client(client)
+
+    from main import app
+    from service import car_service
+
+    test_client = app.test_client()
+    headers = {"Authorization": "Bearer bench"}
+
+    print("{0:>7} {1:>12} {2:>6} {3:>12} {4:>6}".format("spares", "delete ms", "rpcs", "legacy ms", "rpcs"))
+    with mock.patch.object(car_service, "verify_jwt", return_value={"sub": USER_ID}):
+        for spare_count in spare_counts:
+            new_times, legacy_times = [], []
+            new_rpcs = legacy_rpcs = 0
+            for _ in range(repeat):
+                car = seed_car(client, spare_count)
+                client.rpc_counts.clear()
+                client.rpc_latency = rtt
+                start = time.perf_counter()
+                response = test_client.delete("/cars/{0}".format(car.key.id), headers=headers)
+                new_times.append(time.perf_counter() - start)
+                client.rpc_latency = 0.0
+                assert response.status_code == 204, response.data
+                new_rpcs = sum(client.rpc_counts.values())
+
+                car = seed_car(client, spare_count)
+                client.rpc_counts.clear()
+                client.rpc_latency = rtt
+                start = time.perf_counter()
+                legacy_delete(client, car)
+                legacy_times.append(time.perf_counter() - start)
+                client.rpc_latency = 0.0
+                legacy_rpcs = sum(client.rpc_counts.values())
+
+            print("{0:>7} {1:>12.2f} {2:>6} {3:>12.2f} {4:>6}".format(
+                spare_count, statistics.median(new_times) * 1000, new_rpcs,
+                statistics.median(legacy_times) * 1000, legacy_rpcs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spares", type=int, nargs="+", default=[0, 1, 10, 40, 100, 500, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="simulated Datastore round trip per RPC")
+    args = parser.parse_args()
+    run(args.spares, args.repeat, args.rtt_ms / 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+CPU cost of building list responses: the old json.dumps + make_response path that
+copied fields into the entities, against response_helper.json_response.
+
+    python -m benchmark.bench_json --items 5 50 100
+"""
+import argparse
+import json
+import timeit
+
+from flask import Flask
+from google.cloud import datastore
+
+from service import datastore_helper, response_helper
+
+BASE_URL = "https://example.appspot.com/cars"
+
+
+def make_cars(count):
+    cars = []
+    for i in range(count):
+        car = datastore.Entity(key=datastore.Key("cars", i + 1, project="bench"))
+        car.update({"name": "car-{0}".format(i), "model": "model", "reg_num": "KA01AB1234", "color": "red",
+                    "user_id": "auth0|0123456789abcdef"})
+        cars.append(car)
+    return cars
+
+
+def spares_for(car_id):
+    return [{"id": car_id * 10 + i, "self": "https://example.appspot.com/spares/{0}".format(car_id * 10 + i)}
+            for i in range(3)]
+
+
+def legacy_response(app, cars):
+    for car in cars:
+        car["id"] = car.key.id
+        car["self"] = BASE_URL + "/" + str(car.key.id)
+        car["spares"] = spares_for(car.key.id)
+    response = app.make_response(json.dumps({"cars": cars}))
+    response.mimetype = 'application/json'
+    response.status_code = 200
+    return response
+
+
+def new_response(cars):
+    car_ids = [datastore_helper.key_id(car.key) for car in cars]
+    return response_helper.json_response({"cars": [
+        response_helper.entity_to_dict(car, id=car_id, self=BASE_URL + "/" + str(car_id), spares=spares_for(car_id))
+        for car, car_id in zip(cars, car_ids)
+    ]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[5, 50, 100])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    encoder = "orjson" if response_helper.orjson is not None else "json (stdlib fallback)"
+    print("encoder: {0}".format(encoder))
+    print("{0:>6} {1:>14} {2:>14} {3:>9}".format("items", "legacy us", "new us", "saved"))
+    with app.app_context():
+        for count in args.items:
+            legacy_cars, new_cars = make_cars(count), make_cars(count)
+            assert json.loads(legacy_response(app, make_cars(count)).data) == json.loads(new_response(new_cars).data)
+
+            legacy = min(timeit.repeat(lambda: legacy_response(app, legacy_cars), number=args.number, repeat=3))
+            new = min(timeit.repeat(lambda: new_response(new_cars), number=args.number, repeat=3))
+            legacy_us, new_us = legacy / args.number * 1e6, new / args.number * 1e6
+            print("{0:>6} {1:>14.1f} {2:>14.1f} {3:>8.0f}%".format(count, legacy_us, new_us,
+                                                                (1 - new_us / legacy_us) * 100))
+
+
+if __name__ == '__main__':
+    main()
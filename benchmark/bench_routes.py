@@ -0,0 +1,220 @@
+"""
+Microbenchmarks for every route in route/blueprint.py.
+
+Each route runs through the Flask test client against the in-memory storage
+backend, with verify_jwt faked so no identity provider is needed. For every route
+the suite reports latency percentiles, peak memory allocated per request and
+Datastore RPCs per request. Results can be saved as a baseline and later runs
+compared with it, so regressions show up as diffs of benchmark/baseline.json.
+
+    python -m benchmark.bench_routes
+    python -m benchmark.bench_routes --save benchmark/baseline.json
+    python -m benchmark.bench_routes --compare benchmark/baseline.json
+"""
+import argparse
+import itertools
+import json
+import statistics
+import time
+import tracemalloc
+from unittest import mock
+
+from google.cloud import datastore
+
+from service import car_service
+from storage import backend
+from storage.memory_backend import MemoryClient
+
+USER_ID = "bench-user"
+JSON_HEADERS = {"Authorization": "Bearer bench", "Accept": "application/json", "Content-Type": "application/json"}
+
+
+class Fixture:
+    # Seeds the backend and creates fresh entities for routes that consume them
+
+    def __init__(self, client, cars=20, spares_per_car=3, free_spares=50, users=20):
+        self.client = client
+        self.names = itertools.count()
+
+        self.car_ids = [self.add_car() for _ in range(cars)]
+        for car_id in self.car_ids:
+            for _ in range(spares_per_car):
+                self.add_spare(car_id)
+        self.spare_ids = [self.add_spare() for _ in range(free_spares)]
+        for i in range(users):
+            user = datastore.Entity(key=client.key("users", "user-{0}".format(i)))
+            user.update({"sub": "user-{0}".format(i)})
+            client.put(user)
+
+    def unique_name(self):
+        return "bench-{0}".format(next(self.names))
+
+    def add_car(self):
+        car = datastore.Entity(key=self.client.key("cars"))
+        car.update({"name": self.unique_name(), "model": "model", "reg_num": "KA01AB1234", "color": "red",
+                    "user_id": USER_ID})
+        self.client.put(car)
+        self.client.put(datastore.Entity(key=car_service.get_name_reservation_key(car["name"])))
+        return car.key.id
+
+    def add_spare(self, car_id=None):
+        spare = datastore.Entity(key=self.client.key("spares"))
+        spare.update({"name": self.unique_name(), "price": 10.5, "manu_date": "2022-01-01 00:00:00",
+                      "serial_num": 1234, "car_id": car_id, "installed": car_id is not None})
+        self.client.put(spare)
+        return spare.key.id
+
+    def add_spares(self, count, car_id=None):
+        return [self.add_spare(car_id) for _ in range(count)]
+
+    def car_body(self):
+        return {"name": self.unique_name(), "model": "model", "reg_num": "KA01AB1234", "color": "blue"}
+
+    def spare_body(self):
+        return {"name": self.unique_name(), "price": 20.5, "serial_num": 42}
+
+
+# Each scenario returns the request to time: (method, url, json body).
+# Anything it does before returning is setup and is not measured.
+SCENARIOS = {
+    "GET /cars": lambda f: ("GET", "/cars?limit=5", None),
+    "GET /cars?fields=id,name": lambda f: ("GET", "/cars?limit=5&fields=id,name", None),
+    "POST /cars": lambda f: ("POST", "/cars", f.car_body()),
+    "POST /cars/batch": lambda f: ("POST", "/cars/batch", [f.car_body() for _ in range(50)]),
+    "GET /cars/<car_id>": lambda f: ("GET", "/cars/{0}".format(f.car_ids[0]), None),
+    "GET /cars/export": lambda f: ("GET", "/cars/export", None),
+    "PUT /cars/<car_id>": lambda f: ("PUT", "/cars/{0}".format(f.car_ids[1]), f.car_body()),
+    "PATCH /cars/<car_id>": lambda f: ("PATCH", "/cars/{0}".format(f.car_ids[2]), {"color": f.unique_name()}),
+    "DELETE /cars/<car_id>": lambda f: ("DELETE", "/cars/{0}".format(f.add_car()), None),
+    "PUT /cars/<car_id>/spares/<spare_id>":
+        lambda f: ("PUT", "/cars/{0}/spares/{1}".format(f.car_ids[3], f.add_spare()), None),
+    "DELETE /cars/<car_id>/spares/<spare_id>":
+        lambda f: ("DELETE", "/cars/{0}/spares/{1}".format(f.car_ids[4], f.add_spare(f.car_ids[4])), None),
+    "PUT /cars/<car_id>/spares":
+        lambda f: ("PUT", "/cars/{0}/spares".format(f.add_car()), {"spare_ids": f.add_spares(30)}),
+    "DELETE /cars/<car_id>/spares":
+        lambda f: ("DELETE", "/cars/{0}/spares".format(f.car_ids[5]), {"spare_ids": f.add_spares(30, f.car_ids[5])}),
+    "GET /spares": lambda f: ("GET", "/spares?limit=5", None),
+    "GET /spares?fields=id,name": lambda f: ("GET", "/spares?limit=5&fields=id,name", None),
+    "GET /spares?installed=false&min_price=10": lambda f: ("GET", "/spares?limit=5&installed=false&min_price=10",
+                                                            None),
+    "GET /spares?name=bench-1&sort=-name": lambda f: ("GET", "/spares?limit=5&name=bench-1&sort=-name", None),
+    "POST /spares": lambda f: ("POST", "/spares", f.spare_body()),
+    "POST /spares/batch": lambda f: ("POST", "/spares/batch", [f.spare_body() for _ in range(50)]),
+    "GET /spares/export": lambda f: ("GET", "/spares/export", None),
+    "GET /spares/<spare_id>": lambda f: ("GET", "/spares/{0}".format(f.spare_ids[0]), None),
+    "PUT /spares/<spare_id>": lambda f: ("PUT", "/spares/{0}".format(f.spare_ids[1]), f.spare_body()),
+    "PATCH /spares/<spare_id>": lambda f: ("PATCH", "/spares/{0}".format(f.spare_ids[2]), {"price": 30.5}),
+    "DELETE /spares/<spare_id>": lambda f: ("DELETE", "/spares/{0}".format(f.add_spare()), None),
+    "GET /users": lambda f: ("GET", "/users", None),
+    "GET /users?stream=true": lambda f: ("GET", "/users?stream=true", None),
+    "GET /stats/cars": lambda f: ("GET", "/stats/cars", None),
+    "GET /stats/spares": lambda f: ("GET", "/stats/spares", None),
+}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(test_client, fixture, client, scenario, iterations, warmup):
+    def send(request):
+        method, url, body = request
+        response = test_client.open(url, method=method, json=body, headers=JSON_HEADERS)
+        # Streamed bodies are only produced as they are read
+        response.get_data()
+        assert response.status_code < 300, (method, url, response.status_code, response.data)
+
+    for _ in range(warmup):
+        send(scenario(fixture))
+
+    # Latency and RPC counts
+    latencies = []
+    rpcs = 0
+    for _ in range(iterations):
+        request = scenario(fixture)
+        rpcs_before = sum(client.rpc_counts.values())
+        start = time.perf_counter()
+        send(request)
+        latencies.append(time.perf_counter() - start)
+        rpcs += sum(client.rpc_counts.values()) - rpcs_before
+
+    # Allocations, measured separately because tracing slows everything down
+    allocated = []
+    for _ in range(max(1, iterations // 10)):
+        request = scenario(fixture)
+        tracemalloc.start()
+        send(request)
+        allocated.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "peak_alloc_kib": round(statistics.median(allocated) / 1024, 1),
+        "datastore_rpcs": round(rpcs / iterations, 2),
+    }
+
+
+def run(iterations, warmup, rtt, routes=None):
+    from main import app
+    from service import stats_service
+
+    test_client = app.test_client()
+
+    results = {}
+    with mock.patch.object(car_service, "verify_jwt", return_value={"sub": USER_ID}), \
+            mock.patch.object(stats_service, "verify_jwt", return_value={"sub": USER_ID}):
+        for name, scenario in SCENARIOS.items():
+            if routes and name not in routes:
+                continue
+            # Every route starts from the same seeded backend, so what earlier
+            # routes created doesn't slow down the scans of later ones
+            client = MemoryClient(rpc_latency=rtt)
+            backend.set_client(client)
+            results[name] = measure(test_client, Fixture(client), client, scenario, iterations, warmup)
+    return results
+
+
+def print_results(results, baseline=None):
+    columns = ["p50_ms", "p90_ms", "p99_ms", "peak_alloc_kib", "datastore_rpcs"]
+    print("{0:<42}".format("route") + "".join("{0:>22}".format(column) for column in columns))
+    for name, result in results.items():
+        line = "{0:<42}".format(name)
+        for column in columns:
+            cell = "{0:g}".format(result[column])
+            if baseline and name in baseline and baseline[name].get(column):
+                change = (result[column] - baseline[name][column]) / baseline[name][column] * 100
+                cell += " ({0:+.0f}%)".format(change)
+            line += "{0:>22}".format(cell)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="simulated Datastore round trip per RPC")
+    parser.add_argument("--route", action="append", help="only run this route, e.g. 'GET /cars'")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="show changes against a saved baseline")
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.warmup, args.rtt_ms / 1000, args.route)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+            baseline_file.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Per-request cost of validating a car body: the old chain of validate_* functions,
+which stops at the first error, against the compiled schema validator, which
+reports every error in one pass.
+
+    python -m benchmark.bench_validation
+"""
+import argparse
+import timeit
+
+from auth.auth_helper import AuthError
+from constants import constants
+from service import car_service
+
+BODIES = {
+    "valid": {"name": "bench", "model": "model", "reg_num": "KA01AB1234", "color": "red"},
+    "one error": {"name": "bench", "model": "model", "reg_num": "KA01AB1234-TOO-LONG", "color": "red"},
+    "all errors": {"name": 1, "model": "m" * 101, "reg_num": 2, "color": None},
+}
+
+
+def legacy_validate(content):
+    # The checks of the validate_* chain the schema replaced, in the same order
+    if ("name" not in content) or ("model" not in content) or ("reg_num" not in content) \
+            or ("color" not in content):
+        raise AuthError({"Error": constants.missing_attributes_error}, 400)
+
+    for name, type_error, max_length, length_error in (
+            ("name", constants.name_attribute_error, constants.attribute_max_length,
+             constants.attribute_length_error.format("name")),
+            ("model", constants.model_attribute_error, constants.attribute_max_length,
+             constants.attribute_length_error.format("model")),
+            ("reg_num", constants.reg_num_attribute_error, constants.reg_num_max_length,
+             constants.reg_num_max_length_error),
+            ("color", constants.color_attribute_error, constants.attribute_max_length,
+             constants.attribute_length_error.format("color"))):
+        if name in content and not isinstance(content[name], str):
+            raise AuthError({"Error": type_error}, 400)
+        if name in content and len(content[name]) > max_length:
+            raise AuthError({"Error": length_error}, 400)
+
+
+def run_legacy(content):
+    try:
+        legacy_validate(content)
+    except AuthError:
+        pass
+
+
+def run_compiled(content):
+    try:
+        car_service.validate_car_request_body(content)
+    except AuthError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    print("{0:<12} {1:>12} {2:>12} {3:>9} {4:>8}".format("body", "legacy us", "compiled us", "change", "errors"))
+    for name, content in BODIES.items():
+        legacy = min(timeit.repeat(lambda: run_legacy(content), number=args.number, repeat=3))
+        compiled = min(timeit.repeat(lambda: run_compiled(content), number=args.number, repeat=3))
+        legacy_us, compiled_us = legacy / args.number * 1e6, compiled / args.number * 1e6
+        print("{0:<12} {1:>12.2f} {2:>12.2f} {3:>+8.0f}% {4:>8}".format(
+            name, legacy_us, compiled_us, (compiled_us / legacy_us - 1) * 100,
+            len(car_service.validate_car(content))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import time
+
+from google.cloud import datastore
+from google.cloud.datastore import helpers
+from google.cloud.datastore_v1.types import entity as entity_pb2
+
+from cache.lru_cache import LruCache
+
+
+class EntityCache:
+    """
+    Read-through cache of Datastore entities keyed by their key.
+
+    Lookups try the in-process LruCache first, then an optional shared tier and
+    finally Datastore. The shared tier is anything with get, delete and a
+    Redis-style set(key, value, ex=seconds) that stores bytes, e.g. a
+    Memorystore client, so all instances see the same entries. Entities go
+    there as serialized Entity protobufs, never pickles, since whoever can
+    write to a network cache could otherwise run code in the app. Only
+    entities that exist are cached.
+
+    Writers call invalidate() with the keys they put or deleted. Entries in
+    both tiers still expire after ttl seconds, which bounds how long a stale
+    entity can be served, e.g. after a read that raced an invalidate().
+    Entities are copied in and out, so callers can modify what they get.
+    """
+
+    def __init__(self, client, local, shared=None, ttl=None):
+        self.client = client
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+
+    def get(self, key):
+        cache_key = self.cache_key(key)
+
+        entity = self.local.get(cache_key)
+        if entity is None and self.shared is not None:
+            data = self.shared.get(cache_key)
+            if data is not None:
+                entity = load_entity(data)
+                self.local.set(cache_key, entity)
+        if entity is not None:
+            return copy_entity(entity)
+
+        entity = self.client.get(key)
+        if entity is not None:
+            self.local.set(cache_key, copy_entity(entity))
+            if self.shared is not None:
+                self.shared.set(cache_key, dump_entity(entity), ex=self.ttl)
+        return entity
+
+    def invalidate(self, *keys):
+        for key in keys:
+            cache_key = self.cache_key(key)
+            self.local.delete(cache_key)
+            if self.shared is not None:
+                self.shared.delete(cache_key)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    @staticmethod
+    def cache_key(key):
+        return "{0}:{1}".format(key.namespace or "", repr(key.flat_path))
+
+
+def copy_entity(entity):
+    copy = datastore.Entity(key=entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+    copy.update(entity)
+    return copy
+
+
+def dump_entity(entity):
+    return entity_pb2.Entity.serialize(helpers.entity_to_protobuf(entity))
+
+
+def load_entity(data):
+    return helpers.entity_from_protobuf(entity_pb2.Entity.deserialize(data))
+
+
+class LocalSharedCache(LruCache):
+    # In-process stand-in for the shared tier, with the set() of a Redis client
+    def set(self, key, value, ex=None):
+        super().set(key, value, time.time() + ex if ex is not None else None)
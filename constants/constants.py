@@ -1,9 +1,82 @@
+import os
+
 ALGORITHMS = ["RS256"]
 DOMAIN = "xyz.auth.com"
 CLIENT_ID = "client_id"
 CLIENT_SECRET = "client_secret"
 SECRET_KEY = "secret_key"
 
+# Storage backend: "datastore", "memory" or "sqlite"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "datastore")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "local.db")
+
+JWKS_URL = "https://" + DOMAIN + "/.well-known/jwks.json"
+
+# JWKS cache settings (seconds)
+JWKS_CACHE_TTL = 600
+JWKS_FETCH_TIMEOUT = 5
+JWKS_MIN_REFRESH_INTERVAL = 30
+
+# Maximum number of verified bearer tokens kept in memory
+VERIFIED_TOKEN_CACHE_SIZE = 10000
+
+# Maximum number of user subjects remembered as already having a user entity
+KNOWN_USER_CACHE_SIZE = 100000
+
+# Cache of cars and spares read by GET requests. A size of 0 turns it off.
+# Writes on another instance are only seen once the ttl (seconds) runs out.
+ENTITY_CACHE_SIZE = 10000
+ENTITY_CACHE_TTL = 30
+# Shared cache tier: "none", or "local" for an in-process stand-in
+ENTITY_CACHE_SHARED = os.environ.get("ENTITY_CACHE_SHARED", "none")
+
+# Async request path: car handlers run as coroutines and independent
+# Datastore calls run concurrently on a thread pool
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "false").lower() == "true"
+ASYNC_MAX_WORKERS = 16
+
+# Response compression negotiated by Accept-Encoding. Bodies smaller than
+# COMPRESSION_MIN_SIZE bytes are sent as is. Streams are always compressed.
+# Levels go from 1 (fastest) to 9 for gzip and 0 to 11 for brotli.
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.environ.get("COMPRESSION_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))
+compressible_mimetypes = {"application/json", "application/x-ndjson"}
+
+# Datastore limits
+datastore_max_in_filter_values = 30
+datastore_max_batch_size = 500
+transaction_max_retries = 3
+transaction_retry_delay = 0.05
+
+# Pagination
+page_default_limit = 5
+page_max_limit = 100
+users_page_default_limit = 100
+
+# Sparse fieldsets (?fields=). Projecting a car property needs its index
+# from index.yaml. user_id is not read since the query filters on it.
+car_fields = {"id", "name", "model", "reg_num", "color", "user_id", "spares", "self"}
+car_properties = {"name", "model", "reg_num", "color"}
+car_projection_properties = {"name", "model", "reg_num", "color"}
+spare_fields = {"id", "name", "price", "manu_date", "serial_num", "car_id", "installed_car", "self"}
+spare_properties = {"name", "price", "manu_date", "serial_num", "car_id"}
+spare_projection_properties = {"name", "price", "manu_date", "serial_num"}
+
+# GET /spares filters and sort orders. Filtered queries use the indexes from
+# index.yaml. The query parameters are carried over to the next page.
+spare_sort_orders = {"price", "-price", "name", "-name"}
+spare_query_params = ("fields", "min_price", "max_price", "name", "installed", "sort")
+
+# NDJSON exports read this many entities per query batch
+export_batch_size = 500
+
+# Counters are spread over this many shard entities each
+counter_shard_count = 20
+
+# Bulk create endpoints
+batch_max_items = 500
+
 content_type_error = "Content-Type not supported. Application only supports type application/json"
 missing_attributes_error = "The request object is missing at least one of the required attributes"
 name_attribute_error = "The attribute 'name' is not valid"
@@ -17,10 +90,26 @@ reg_num_max_length = 10
 reg_num_max_length_error = "The attribute 'reg_num' cannot contain more than 10 characters"
 car_with_name_exists_error = "A car with name {0} already exists"
 invalid_attribute_error = "The attribute '{0}' is not valid"
+immutable_attribute_error = "The attribute '{0}' cannot be updated"
+unknown_attribute_error = "The attribute '{0}' is not supported"
+body_type_error = "The request body must be a JSON object"
 
 car_not_found_error = "No car with this car_id exists"
 spare_not_found_error = "No spare with this spare_id exists"
 spare_installed_error = "The spare is already installed on another car"
 car_not_installed_with_spare_error = "No car with this car_id is installed with the spare with this spare_id"
 
+page_limit_error = "The query parameter 'limit' must be between 1 and {0}"
+invalid_query_param_error = "The query parameter '{0}' is not valid"
+filter_conflict_error = "The query parameters '{0}' and '{1}' cannot be combined"
+sort_conflict_error = "Results filtered on '{0}' can only be sorted by '{0}'"
+
+batch_body_error = "The request body must be an array of 1 to {0} items"
+batch_item_error = "Each item must be a JSON object"
+spare_ids_error = "The attribute 'spare_ids' must be an array of 1 to {0} integer spare ids"
+
+precondition_failed_error = "The resource was modified since it was last read"
+
+jwks_unavailable_error = "Unable to fetch the signing keys. Please try again later"
+
 all_attributes_error = "Bad HTTP method. PATCH cannot update all attributes, please use PUT operation."
@@ -1,12 +1,15 @@
 from urllib.parse import urlencode, quote_plus
 
 from authlib.integrations.flask_client import OAuth
-from flask import render_template, url_for, redirect, current_app as app
+from flask import render_template, url_for, redirect
 
+from auth.auth_helper import decode_auth_token
 from constants import constants
 from service import user_service
 
-oauth = OAuth(app)
+# Bound to the app in create_app(). The metadata at server_metadata_url is
+# only fetched on the first login.
+oauth = OAuth()
 
 oauth.register(
     "auth0",
@@ -31,7 +34,13 @@ def login():
 
 def callback():
     token_payload = oauth.auth0.authorize_access_token()
-    user_id = user_service.create_user(token_payload["id_token"])
+
+    # authlib has already verified the ID token and parsed its claims
+    userinfo = token_payload.get("userinfo")
+    if userinfo is None:
+        userinfo = decode_auth_token(token_payload["id_token"])
+
+    user_id = user_service.create_user(userinfo["sub"])
     return render_template('data.html', token=token_payload["id_token"], userId=user_id)
 
 
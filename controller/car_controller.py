@@ -1,13 +1,32 @@
-from service import car_service
+from flask import current_app as app
+
+from constants import constants
+from service import async_car_service, car_service
 
 
 def get_all_and_create_car():
+    if constants.ASYNC_VIEWS:
+        return app.ensure_sync(async_car_service.get_all_and_create_car)()
     return car_service.get_all_and_create_car()
 
 
 def get_update_and_delete_car(car_id):
+    if constants.ASYNC_VIEWS:
+        return app.ensure_sync(async_car_service.get_update_and_delete_car)(car_id)
     return car_service.get_update_and_delete_car(car_id)
 
 
 def install_and_remove_spare(car_id, spare_id):
     return car_service.install_and_remove_spare(car_id, spare_id)
+
+
+def install_and_remove_spares(car_id):
+    return car_service.install_and_remove_spares(car_id)
+
+
+def create_cars_batch():
+    return car_service.create_cars_batch()
+
+
+def export_cars():
+    return car_service.export_cars()
@@ -0,0 +1,10 @@
+from flask import current_app as app
+
+from monitoring import metrics
+
+
+def get_metrics():
+    response = app.make_response(metrics.render())
+    response.mimetype = 'text/plain; version=0.0.4'
+    response.status_code = 200
+    return response
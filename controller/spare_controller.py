@@ -7,3 +7,11 @@ def get_all_and_create_spare():
 
 def get_update_and_delete_spare(spare_id):
     return spare_service.get_update_and_delete_spare(spare_id)
+
+
+def create_spares_batch():
+    return spare_service.create_spares_batch()
+
+
+def export_spares():
+    return spare_service.export_spares()
@@ -0,0 +1,9 @@
+from service import stats_service
+
+
+def get_car_stats():
+    return stats_service.get_car_stats()
+
+
+def get_spare_stats():
+    return stats_service.get_spare_stats()
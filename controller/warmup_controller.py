@@ -0,0 +1,5 @@
+from service import warmup_service
+
+
+def warmup():
+    return warmup_service.warm_up()
@@ -1,13 +1,39 @@
 from flask import Flask
 
 from constants import constants
-from auth.auth_helper import handle_auth_error, AuthError
+from auth.auth_helper import handle_auth_error, AuthError, verified_token_cache
+from controller.auth_controller import oauth
+from monitoring import metrics, timing
 from route.blueprint import blueprint
+from service import compression_helper
+from service.user_service import known_users
+from storage.backend import entity_cache
 
-app = Flask(__name__)
-app.register_blueprint(blueprint, url_prefix="/")
-app.register_error_handler(AuthError, handle_auth_error)
-app.secret_key = constants.SECRET_KEY
+
+def create_app():
+    # Nothing here talks to the network. The Datastore client is created on
+    # first use and shared by every service, and the OIDC metadata is only
+    # fetched on the first login. /_ah/warmup opens the connections early.
+    app = Flask(__name__)
+    app.register_blueprint(blueprint, url_prefix="/")
+    app.register_error_handler(AuthError, handle_auth_error)
+    app.secret_key = constants.SECRET_KEY
+    oauth.init_app(app)
+
+    # Per-request spans, Server-Timing header and /metrics histograms
+    app.before_request(timing.start_request)
+    app.after_request(timing.finish_request)
+    # Registered last so it runs first and its span is in Server-Timing
+    app.after_request(compression_helper.compress_response)
+    metrics.register_cache("verified_tokens", verified_token_cache)
+    metrics.register_cache("entities", entity_cache.local)
+    metrics.register_cache("known_users", known_users)
+    if entity_cache.shared is not None:
+        metrics.register_cache("entities_shared", entity_cache.shared)
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=8080, debug=True)
@@ -0,0 +1,52 @@
+"""
+Backfills the car_names reservations for cars created before names were reserved.
+
+Safe to run more than once. Names held by more than one car are reported so they
+can be fixed by hand, since only one of those cars can keep the name. Run it again
+after reservation keys changed to "name:<name>", to reserve every name in that form
+and delete the reservations keyed by the bare name, in the same commits.
+
+    python -m migrations.backfill_car_name_reservations
+"""
+from google.cloud import datastore
+
+from constants import constants
+from service import car_service, datastore_helper
+from storage.backend import get_client
+
+
+def main():
+    client = get_client()
+
+    cars_by_name = {}
+    cars_query = client.query(kind="cars")
+    cars_query.projection = ["name"]
+    for car in cars_query.fetch():
+        cars_by_name.setdefault(car["name"], []).append(car.key.id)
+
+    reservation_keys = {car_service.get_name_reservation_key(name) for name in cars_by_name}
+
+    # Each commit reserves a batch of names and deletes their old keys. A bare
+    # name like "name:x" is also the new key of the car named "x", so it stays.
+    # Datastore never stored the empty name or names like __x__ as keys.
+    deleted = 0
+    for batch in datastore_helper.chunks(list(cars_by_name), constants.datastore_max_batch_size // 2):
+        old_keys = [client.key("car_names", name) for name in batch if is_legacy_key_name(name)]
+        old_keys = [key for key in old_keys if key not in reservation_keys]
+        with client.transaction():
+            client.put_multi([datastore.Entity(key=car_service.get_name_reservation_key(name)) for name in batch])
+            client.delete_multi(old_keys)
+        deleted += len(old_keys)
+
+    print("Reserved {0} car names, deleted {1} old reservations".format(len(reservation_keys), deleted))
+    for name, car_ids in cars_by_name.items():
+        if len(car_ids) > 1:
+            print("Name {0!r} is used by more than one car: {1}".format(name, car_ids))
+
+
+def is_legacy_key_name(name):
+    return name != "" and not (name.startswith("__") and name.endswith("__"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Backfills the installed flag GET /spares?installed= filters on, and stores
+integer prices as floats so price ranges match them. Datastore orders every
+integer before every float, so a range on a float only matches floats.
+
+Each batch is read and written in one transaction, so spares installed or
+removed meanwhile keep their car. Safe to run more than once.
+
+    python -m migrations.backfill_spare_installed
+"""
+from constants import constants
+from service import datastore_helper
+from storage.backend import get_client
+
+
+def backfill(client, keys):
+    # Runs in a transaction. Returns the number of spares that changed.
+    changed = []
+    for spare in client.get_multi(keys):
+        int_price = isinstance(spare.get("price"), int) and not isinstance(spare.get("price"), bool)
+        if "installed" in spare and "car_id" in spare and not int_price:
+            continue
+        datastore_helper.set_installed_car(spare, spare.get("car_id"))
+        if int_price:
+            spare["price"] = float(spare["price"])
+        datastore_helper.bump_version(spare)
+        changed.append(spare)
+    client.put_multi(changed)
+    return len(changed)
+
+
+def main():
+    client = get_client()
+
+    spares_query = client.query(kind="spares")
+    spares_query.keys_only()
+    keys = [spare.key for spare in spares_query.fetch()]
+
+    updated = 0
+    for batch in datastore_helper.chunks(keys, constants.datastore_max_batch_size):
+        updated += datastore_helper.run_in_transaction(client, backfill, client, batch)
+
+    print("Updated {0} of {1} spares".format(updated, len(keys)))
+
+
+if __name__ == '__main__':
+    main()
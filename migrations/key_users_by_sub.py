@@ -0,0 +1,42 @@
+"""
+Moves users created with auto-allocated ids to entities keyed by their sub.
+
+Safe to run more than once. Duplicate users of one sub, which the old
+query-then-insert login could create, end up as a single entity.
+
+    python -m migrations.key_users_by_sub
+"""
+from google.cloud import datastore
+
+from constants import constants
+from service import datastore_helper
+from storage.backend import get_client
+
+
+def main():
+    client = get_client()
+
+    users_by_sub = {}
+    users_query = client.query(kind="users")
+    for user in users_query.fetch():
+        if user.key.id is not None:
+            users_by_sub.setdefault(user["sub"], []).append(user)
+
+    # Write the keyed users before deleting the old ones, so no user is ever missing
+    keyed_users = []
+    for sub, users in users_by_sub.items():
+        keyed_user = datastore.Entity(key=client.key('users', sub))
+        keyed_user.update(users[0])
+        keyed_users.append(keyed_user)
+    for batch in datastore_helper.chunks(keyed_users, constants.datastore_max_batch_size):
+        client.put_multi(batch)
+
+    old_keys = [user.key for users in users_by_sub.values() for user in users]
+    for batch in datastore_helper.chunks(old_keys, constants.datastore_max_batch_size):
+        client.delete_multi(batch)
+
+    print("Keyed {0} users by sub and removed {1} old user entities".format(len(keyed_users), len(old_keys)))
+
+
+if __name__ == '__main__':
+    main()
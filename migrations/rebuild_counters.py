@@ -0,0 +1,51 @@
+"""
+Recomputes the sharded counters behind /stats from the cars and spares.
+
+Counts the cars of every user and the installed and free spares with their
+total price, then writes each total to shard 0 of its counter and deletes all
+other shards. Writes that commit while the job scans can be missed, so run it
+when the API is idle. Safe to run more than once.
+
+    python -m migrations.rebuild_counters
+"""
+from google.cloud import datastore
+
+from constants import constants
+from service import counter_helper, datastore_helper
+from storage.backend import get_client
+
+
+def main():
+    client = get_client()
+
+    deltas = {counter_helper.INSTALLED_SPARES: [0, 0], counter_helper.FREE_SPARES: [0, 0]}
+    cars_query = client.query(kind="cars")
+    cars_query.projection = ["user_id"]
+    for car in cars_query.fetch():
+        counter_helper.count_car(deltas, car, 1)
+
+    spares_query = client.query(kind="spares")
+    for spare in spares_query.fetch():
+        counter_helper.count_spare(deltas, spare, 1)
+
+    shards = []
+    for name, (count, value) in deltas.items():
+        shard = datastore.Entity(key=counter_helper.shard_key(name, 0), exclude_from_indexes=("count", "value"))
+        shard.update({"count": count, "value": value})
+        shards.append(shard)
+    for batch in datastore_helper.chunks(shards, constants.datastore_max_batch_size):
+        client.put_multi(batch)
+
+    # Every other shard, including those of users without cars, goes
+    shard_keys = {shard.key for shard in shards}
+    shards_query = client.query(kind="counter_shards")
+    shards_query.keys_only()
+    old_keys = [shard.key for shard in shards_query.fetch() if shard.key not in shard_keys]
+    for batch in datastore_helper.chunks(old_keys, constants.datastore_max_batch_size):
+        client.delete_multi(batch)
+
+    print("Rebuilt {0} counters and removed {1} old shards".format(len(shards), len(old_keys)))
+
+
+if __name__ == '__main__':
+    main()
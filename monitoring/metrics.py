@@ -0,0 +1,108 @@
+import threading
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RPC_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+class Histogram:
+    # Prometheus histogram with one series per label set
+
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation), "# TYPE {0} histogram".format(self.name)]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                labels = format_labels(zip(self.label_names, label_values))
+                for bound, count in zip(self.buckets, series["counts"]):
+                    bucket_labels = format_labels(list(zip(self.label_names, label_values)) + [("le", bound)])
+                    lines.append("{0}_bucket{1} {2}".format(self.name, bucket_labels, count))
+                inf_labels = format_labels(list(zip(self.label_names, label_values)) + [("le", "+Inf")])
+                lines.append("{0}_bucket{1} {2}".format(self.name, inf_labels, series["count"]))
+                lines.append("{0}_sum{1} {2}".format(self.name, labels, series["sum"]))
+                lines.append("{0}_count{1} {2}".format(self.name, labels, series["count"]))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation), "# TYPE {0} counter".format(self.name)]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append("{0}{1} {2}".format(self.name, format_labels(zip(self.label_names, label_values)),
+                                                 value))
+        return lines
+
+
+request_duration = Histogram("http_request_duration_seconds", "Request latency by route.",
+                             ("method", "route", "status"), LATENCY_BUCKETS)
+request_datastore_rpcs = Histogram("http_request_datastore_rpcs", "Datastore RPCs issued per request by route.",
+                                   ("method", "route"), RPC_COUNT_BUCKETS)
+span_seconds = Counter("request_span_seconds_total", "Time spent in each named span.", ("span",))
+span_calls = Counter("request_span_calls_total", "Number of times each named span ran.", ("span",))
+
+_metrics = [request_duration, request_datastore_rpcs, span_seconds, span_calls]
+_cache_stats = {}
+
+
+def register_cache(name, cache):
+    # Export the hit/miss counters of anything with a stats() method
+    _cache_stats[name] = cache
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+
+    if _cache_stats:
+        for stat, metric_type in (("hits", "counter"), ("misses", "counter"), ("size", "gauge")):
+            name = "cache_{0}".format(stat) + ("_total" if metric_type == "counter" else "")
+            lines.append("# HELP {0} Cache {1} by cache.".format(name, stat))
+            lines.append("# TYPE {0} {1}".format(name, metric_type))
+            for cache_name, cache in sorted(_cache_stats.items()):
+                lines.append("{0}{1} {2}".format(name, format_labels([("cache", cache_name)]),
+                                                 cache.stats()[stat]))
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(name, escape_label(value)) for name, value in labels) + "}"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
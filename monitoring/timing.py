@@ -0,0 +1,76 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+from monitoring import metrics
+
+DATASTORE_SPAN_PREFIX = "datastore."
+
+# Spans of one request can be recorded from several threads on the async path
+_lock = threading.Lock()
+
+
+@contextmanager
+def span(name):
+    # Time a block and add it to the current request's spans. Outside of a
+    # request (e.g. background JWKS refresh) the block just runs.
+    if not has_request_context() or "spans" not in g:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def record(name, elapsed):
+    # Add an already measured duration to the current request's spans
+    if not has_request_context() or "spans" not in g:
+        return
+    with _lock:
+        total, calls = g.spans.get(name, (0.0, 0))
+        g.spans[name] = (total + elapsed, calls + 1)
+
+
+def timed(name):
+    # Decorator form of span()
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request():
+    g.spans = {}
+    g.request_start = time.perf_counter()
+
+
+def finish_request(response):
+    if "request_start" not in g:
+        return response
+
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    entries = []
+    datastore_rpcs = 0
+    for name, (total, calls) in sorted(g.spans.items()):
+        entries.append('{0};dur={1:.2f};desc="{2} calls"'.format(name, total * 1000, calls))
+        metrics.span_seconds.inc(total, name)
+        metrics.span_calls.inc(calls, name)
+        if name.startswith(DATASTORE_SPAN_PREFIX):
+            datastore_rpcs += calls
+    entries.append("total;dur={0:.2f}".format(elapsed * 1000))
+    response.headers.add("Server-Timing", ", ".join(entries))
+
+    metrics.request_duration.observe(elapsed, request.method, route, response.status_code)
+    metrics.request_datastore_rpcs.observe(datastore_rpcs, request.method, route)
+    return response
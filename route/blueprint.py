@@ -2,9 +2,12 @@ from flask import Blueprint
 
 from controller import car_controller, spare_controller
 from controller.auth_controller import welcome, login, logout, callback
-from controller.car_controller import get_all_and_create_car
-from controller.spare_controller import get_all_and_create_spare
+from controller.car_controller import get_all_and_create_car, create_cars_batch, export_cars
+from controller.metrics_controller import get_metrics
+from controller.spare_controller import get_all_and_create_spare, create_spares_batch, export_spares
+from controller.stats_controller import get_car_stats, get_spare_stats
 from controller.user_controller import get_all_users
+from controller.warmup_controller import warmup
 
 blueprint = Blueprint('blueprint', __name__)
 
@@ -22,6 +25,8 @@ blueprint.route('/logout', methods=['GET'])(logout)
 
 # Car APIs
 blueprint.route('/cars', methods=['GET', 'POST'])(get_all_and_create_car)
+blueprint.route('/cars/batch', methods=['POST'])(create_cars_batch)
+blueprint.route('/cars/export', methods=['GET'])(export_cars)
 
 
 @blueprint.route('/cars/<car_id>', methods=['GET', 'PUT', 'PATCH', 'DELETE'])
@@ -34,8 +39,15 @@ def install_and_remove_spare(car_id, spare_id):
     return car_controller.install_and_remove_spare(car_id, spare_id)
 
 
+@blueprint.route('/cars/<car_id>/spares', methods=['PUT', 'DELETE'])
+def install_and_remove_spares(car_id):
+    return car_controller.install_and_remove_spares(car_id)
+
+
 # Spare APIs
 blueprint.route('/spares', methods=['GET', 'POST'])(get_all_and_create_spare)
+blueprint.route('/spares/batch', methods=['POST'])(create_spares_batch)
+blueprint.route('/spares/export', methods=['GET'])(export_spares)
 
 
 @blueprint.route('/spares/<spare_id>', methods=['GET', 'PUT', 'PATCH', 'DELETE'])
@@ -45,3 +57,13 @@ def get_and_delete_spare(spare_id):
 
 # User APIs
 blueprint.route('/users', methods=['GET'])(get_all_users)
+
+# Stats APIs
+blueprint.route('/stats/cars', methods=['GET'])(get_car_stats)
+blueprint.route('/stats/spares', methods=['GET'])(get_spare_stats)
+
+# Monitoring APIs
+blueprint.route('/metrics', methods=['GET'])(get_metrics)
+
+# App Engine warmup requests
+blueprint.route('/_ah/warmup', methods=['GET'])(warmup)
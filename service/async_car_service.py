@@ -0,0 +1,103 @@
+import asyncio
+import itertools
+
+from flask import request
+
+from auth.auth_helper import verify_jwt
+from constants import constants
+from service import car_service, datastore_helper, etag_helper, fields_helper, validation_helper
+from storage.backend import async_client, client, entity_cache
+
+# Coroutine versions of the car handlers that have independent Datastore calls.
+# They share their validation and responses with car_service and only differ
+# in running those calls concurrently. Everything else is handled by
+# car_service as is.
+
+
+async def get_all_and_create_car():
+    if request.method != 'GET':
+        return car_service.get_all_and_create_car()
+
+    validation_helper.validate_accept_header()
+
+    payload = await async_client.run(verify_jwt, request)
+    user_id = payload["sub"]
+
+    fields = fields_helper.get_fields(constants.car_fields)
+    all_cars, next_url = await async_client.run(car_service.get_cars_page, user_id, fields)
+
+    # If there are no cars created by the user, return an empty list
+    if len(all_cars) == 0:
+        return {"cars": []}, 200
+
+    car_ids = [datastore_helper.key_id(car.key) for car in all_cars]
+    if fields_helper.wants(fields, "spares"):
+        spares_by_car = await get_spares_for_cars(car_ids)
+    else:
+        spares_by_car = dict.fromkeys(car_ids)
+
+    return car_service.cars_page_response(all_cars, car_ids, spares_by_car, fields, user_id, next_url)
+
+
+async def get_update_and_delete_car(car_id):
+    car_id = int(car_id)
+
+    if request.method == 'GET':
+        validation_helper.validate_accept_header()
+
+        fields = fields_helper.get_fields(constants.car_fields)
+
+        # The spares query doesn't depend on the car, so it runs alongside the
+        # token check and the car lookup. A conditional GET is likely to end in
+        # a 304, so it only queries the spares once the car is known.
+        calls = [async_client.run(verify_jwt, request), async_client.run(entity_cache.get, client.key('cars', car_id))]
+        prefetch_spares = fields_helper.wants(fields, "spares") and not request.if_none_match
+        if prefetch_spares:
+            calls.append(async_client.run(car_service.get_spares_for_car, car_id))
+
+        payload, car, *prefetched = await asyncio.gather(*calls)
+        car_service.check_car(car, payload["sub"])
+
+        etag = fields_helper.fields_etag(car_service.get_car_etag(car), fields)
+        if etag_helper.is_fresh(etag):
+            return etag_helper.not_modified(etag)
+
+        if prefetch_spares:
+            installed_spares = prefetched[0]
+        elif fields_helper.wants(fields, "spares"):
+            installed_spares = await async_client.run(car_service.get_spares_for_car, car_id)
+        else:
+            installed_spares = None
+
+        return car_service.car_response(car_id, car, installed_spares, fields, etag)
+
+    elif request.method == 'PUT':
+        validation_helper.validate_content_type()
+
+        car = await get_owned_car(car_id)
+        return car_service.update_car(car_id, car, car_service.validate_car_request_body)
+
+    elif request.method == 'PATCH':
+        validation_helper.validate_content_type()
+
+        car = await get_owned_car(car_id)
+        return car_service.update_car(car_id, car, car_service.validate_car_request_body_for_patch)
+
+    return car_service.get_update_and_delete_car(car_id)
+
+
+async def get_owned_car(car_id):
+    # perform_basic_validations with the token check and the car lookup
+    # running at the same time
+    payload, car = await asyncio.gather(async_client.run(verify_jwt, request),
+                                        async_client.get(client.key('cars', car_id)))
+    car_service.check_car(car, payload["sub"])
+    return car
+
+
+async def get_spares_for_cars(car_ids):
+    # car_service.get_spares_for_cars with the query for every chunk of car
+    # ids in flight at once
+    chunks = datastore_helper.chunks(car_ids, constants.datastore_max_in_filter_values)
+    results = await asyncio.gather(*[async_client.run(car_service.query_spares_for_cars, chunk) for chunk in chunks])
+    return car_service.group_spares_by_car(car_ids, itertools.chain.from_iterable(results))
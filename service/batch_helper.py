@@ -0,0 +1,48 @@
+from flask import request
+
+from auth.auth_helper import AuthError
+from constants import constants
+from service import response_helper
+
+
+def get_batch_items():
+    # The body of a batch request is a JSON array of items
+    items = request.get_json()
+    if not isinstance(items, list) or not 0 < len(items) <= constants.batch_max_items:
+        raise AuthError({"Error": constants.batch_body_error.format(constants.batch_max_items)}, 400)
+    return items
+
+
+def validate_items(items, validate):
+    # Validate every item with a compiled schema validator before anything is
+    # written. Returns the valid items as (index, item) pairs and the results
+    # of the invalid ones by index.
+    valid_items = []
+    results = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = error_result(index, constants.batch_item_error, 400)
+            continue
+
+        errors = validate(item)
+        if errors:
+            results[index] = error_result(index, errors[0], 400)
+            results[index]["Errors"] = errors
+            continue
+        valid_items.append((index, item))
+    return valid_items, results
+
+
+def created_result(index, entity_id, self):
+    return {"index": index, "status": 201, "id": entity_id, "self": self}
+
+
+def error_result(index, message, status_code):
+    return {"index": index, "status": status_code, "Error": message}
+
+
+def batch_response(results):
+    # 201 when every item was created, otherwise 207 with the status of each item
+    results = [results[index] for index in sorted(results)]
+    all_created = all(result["status"] == 201 for result in results)
+    return response_helper.json_response({"results": results}, 201 if all_created else 207)
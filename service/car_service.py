@@ -1,12 +1,14 @@
-import json
-
-from flask import request, current_app as app
+from flask import request
 from google.cloud import datastore
 
 from auth.auth_helper import verify_jwt, AuthError
 from constants import constants
-
-client = datastore.Client()
+from service import (
+    batch_helper, counter_helper, datastore_helper, etag_helper, export_helper, fields_helper, pagination_helper,
+    response_helper, validation_helper,
+)
+from service.validation_helper import validate_accept_header, validate_content_type
+from storage.backend import client, entity_cache
 
 
 def get_all_and_create_car():
@@ -20,26 +22,14 @@ def get_all_and_create_car():
         # Validate request body
         validate_car_request_body(content)
 
-        # No need to filter using user id.
+        # Add car to datastore.
         # Car name should be unique across all users
-        cars_query = client.query(kind="cars")
-        cars_query.add_filter("name", "=", content["name"])
-        all_cars = list(cars_query.fetch())
+        new_car = build_car(client.key('cars'), content, user_id)
 
         # Check if a car with the name already exists in datastore
-        if len(all_cars) > 0:
-            return {"Error": constants.car_with_name_exists_error.format(content["name"])}, 403
-
-        # Add car to datastore
-        new_car = datastore.Entity(key=client.key('cars'))
-        new_car.update({
-            "name": content["name"],
-            "model": content["model"],
-            "reg_num": content["reg_num"],
-            "color": content["color"],
-            "user_id": user_id
-        })
-        client.put(new_car)
+        error = datastore_helper.run_in_transaction(client, put_new_car, new_car)
+        if error:
+            return error
 
         self = request.base_url + "/{0}".format(new_car.key.id)
 
@@ -52,10 +42,7 @@ def get_all_and_create_car():
             "self": self
         }
 
-        response = app.make_response(json.dumps(response))
-        response.mimetype = 'application/json'
-        response.status_code = 201
-        return response
+        return etag_helper.with_etag(response_helper.json_response(response, 201), get_car_etag(new_car))
 
     elif request.method == 'GET':
         validate_accept_header()
@@ -63,135 +50,368 @@ def get_all_and_create_car():
         payload = verify_jwt(request)
         user_id = payload["sub"]
 
-        cars_query = client.query(kind="cars")
-        cars_query.add_filter("user_id", "=", user_id)
-        limit = int(request.args.get('limit', '5'))
-        offset = int(request.args.get('offset', '0'))
-        left_iterator = cars_query.fetch(limit=limit, offset=offset)
-        pages = left_iterator.pages
-        all_cars = list(next(pages))
+        fields = fields_helper.get_fields(constants.car_fields)
+        all_cars, next_url = get_cars_page(user_id, fields)
 
         # If there are no cars created by the user, return an empty list
         if len(all_cars) == 0:
             return {"cars": []}, 200
 
-        if left_iterator.next_page_token:
-            next_offset = offset + limit
-            next_url = request.base_url + "?limit=" + str(limit) + "&offset=" + str(next_offset)
+        # Get the spares for the whole page at once, unless they are not wanted
+        car_ids = [datastore_helper.key_id(car.key) for car in all_cars]
+        if fields_helper.wants(fields, "spares"):
+            spares_by_car = get_spares_for_cars(car_ids)
         else:
-            next_url = None
+            spares_by_car = dict.fromkeys(car_ids)
 
-        for car in all_cars:
-            car["id"] = car.key.id
-            car["self"] = request.base_url + "/" + str(car.key.id)
-            car["spares"] = get_spares_for_car(car.key.id)
+        return cars_page_response(all_cars, car_ids, spares_by_car, fields, user_id, next_url)
+    else:
+        return {"Error": "Method not supported!"}, 405
 
-        output = {"cars": all_cars}
 
-        if next_url:
-            output["next"] = next_url
+def get_cars_page(user_id, fields):
+    # One page of the user's cars and the url of the next page
+    cars_query = client.query(kind="cars")
+    cars_query.add_filter("user_id", "=", user_id)
+    fields_helper.apply_projection(cars_query, fields, constants.car_properties,
+                                   constants.car_projection_properties)
+    limit, cursor, offset = pagination_helper.get_page_params()
+    all_cars, next_cursor = pagination_helper.fetch_page(cars_query, limit, cursor, offset)
 
-        response = app.make_response(json.dumps(output))
-        response.mimetype = 'application/json'
-        response.status_code = 200
-        return response
+    if next_cursor and fields is not None:
+        next_url = pagination_helper.next_page_url(limit, next_cursor, fields=request.args["fields"])
+    elif next_cursor:
+        next_url = pagination_helper.next_page_url(limit, next_cursor)
     else:
-        return {"Error": "Method not supported!"}, 405
+        next_url = None
 
+    return all_cars, next_url
 
-def get_update_and_delete_car(car_id):
-    car_id = int(car_id)
 
-    if request.method == 'GET':
-        validate_accept_header()
+def cars_page_response(all_cars, car_ids, spares_by_car, fields, user_id, next_url):
+    output = {"cars": [
+        fields_helper.select(response_helper.entity_to_dict(car,
+                                                            id=car_id,
+                                                            user_id=user_id,
+                                                            self=request.base_url + "/" + str(car_id),
+                                                            spares=spares_by_car[car_id]), fields)
+        for car, car_id in zip(all_cars, car_ids)
+    ]}
 
-        car = perform_basic_validations(car_id)
+    if next_url:
+        output["next"] = next_url
 
-        # Get spares that are installed in the car
-        installed_spares = get_spares_for_car(car_id)
+    return response_helper.json_response(output)
 
-        car["id"] = car_id
-        car["spares"] = installed_spares
-        car["self"] = request.base_url
 
-        response = app.make_response(json.dumps(car))
-        response.mimetype = 'application/json'
-        response.status_code = 200
-        return response
+def create_cars_batch():
+    validate_content_type()
 
-    elif request.method == 'PUT':
-        validate_content_type()
+    payload = verify_jwt(request)
+    user_id = payload["sub"]
 
-        car = perform_basic_validations(car_id)
+    # Validate every car before anything is written
+    items = batch_helper.get_batch_items()
+    valid_items, results = batch_helper.validate_items(items, validate_car)
+
+    # Only the first car in the batch can take a name
+    names = set()
+    new_items = []
+    for index, content in valid_items:
+        if content["name"] in names:
+            results[index] = batch_helper.error_result(
+                index, constants.car_with_name_exists_error.format(content["name"]), 403)
+            continue
+        names.add(content["name"])
+        new_items.append((index, content))
+
+    # Reserve all ids in one RPC
+    keys = client.allocate_ids(client.key('cars'), len(new_items)) if new_items else []
+    new_cars = [(index, build_car(key, content, user_id)) for (index, content), key in zip(new_items, keys)]
+
+    # Each car and its name reservation are two mutations of the same commit,
+    # plus one for the user's car counter
+    for chunk in datastore_helper.chunks(new_cars, (constants.datastore_max_batch_size - 1) // 2):
+        taken = datastore_helper.run_in_transaction(client, reserve_names_and_put_cars, [car for _, car in chunk])
+        for index, car in chunk:
+            if car["name"] in taken:
+                results[index] = batch_helper.error_result(
+                    index, constants.car_with_name_exists_error.format(car["name"]), 403)
+            else:
+                car_id = datastore_helper.key_id(car.key)
+                results[index] = batch_helper.created_result(index, car_id,
+                                                             request.host_url + "cars/{0}".format(car_id))
+
+    return batch_helper.batch_response(results)
+
+
+def export_cars():
+    payload = verify_jwt(request)
+    user_id = payload["sub"]
 
-        content = request.get_json()
-        validate_car_request_body(content)
+    cars_query = client.query(kind="cars")
+    cars_query.add_filter("user_id", "=", user_id)
+    cursor = pagination_helper.get_cursor()
 
-        if car['name'] != content['name']:
-            cars_query = client.query(kind="cars")
-            cars_query.add_filter("name", "=", content["name"])
-            all_cars = list(cars_query.fetch())
+    base_url = request.host_url + "cars/"
 
-            # Check if a car with the name already exists in datastore
-            if len(all_cars) > 0:
-                return {"Error": constants.car_with_name_exists_error.format(content["name"])}, 403
+    def car_to_dict(car):
+        car_id = datastore_helper.key_id(car.key)
+        return response_helper.entity_to_dict(car, id=car_id, self=base_url + str(car_id))
 
-        car.update(content)
-        client.put(car)
+    return export_helper.ndjson_response(cars_query, cursor, car_to_dict)
 
-        car["id"] = car_id
-        car["self"] = request.base_url
 
-        response = app.make_response(json.dumps(car))
-        response.mimetype = 'application/json'
-        response.status_code = 200
-        return response
+def get_update_and_delete_car(car_id):
+    car_id = int(car_id)
 
-    elif request.method == 'PATCH':
-        validate_content_type()
+    if request.method == 'GET':
+        validate_accept_header()
 
-        car = perform_basic_validations(car_id)
+        fields = fields_helper.get_fields(constants.car_fields)
 
-        content = request.get_json()
-        validate_car_request_body_for_patch(content)
+        car = perform_basic_validations(car_id, cached=True)
 
-        if "name" in content and car['name'] != content['name']:
-            cars_query = client.query(kind="cars")
-            cars_query.add_filter("name", "=", content["name"])
-            all_cars = list(cars_query.fetch())
+        # The car's version changes whenever its spares do, so a poll that
+        # matches skips the spares query as well
+        etag = fields_helper.fields_etag(get_car_etag(car), fields)
+        if etag_helper.is_fresh(etag):
+            return etag_helper.not_modified(etag)
 
-            # Check if a car with the name already exists in datastore
-            if len(all_cars) > 0:
-                return {"Error": constants.car_with_name_exists_error.format(content["name"])}, 403
+        # Get spares that are installed in the car
+        installed_spares = get_spares_for_car(car_id) if fields_helper.wants(fields, "spares") else None
+
+        return car_response(car_id, car, installed_spares, fields, etag)
 
-        car.update(content)
-        client.put(car)
+    elif request.method == 'PUT':
+        validate_content_type()
 
-        car["id"] = car_id
-        car["self"] = request.base_url
+        car = perform_basic_validations(car_id)
+        return update_car(car_id, car, validate_car_request_body)
+
+    elif request.method == 'PATCH':
+        validate_content_type()
 
-        response = app.make_response(json.dumps(car))
-        response.mimetype = 'application/json'
-        response.status_code = 200
-        return response
+        car = perform_basic_validations(car_id)
+        return update_car(car_id, car, validate_car_request_body_for_patch)
 
     elif request.method == 'DELETE':
         car = perform_basic_validations(car_id)
+        etag = get_car_etag(car)
+        etag_helper.check_if_match(etag)
 
-        # Get spares that are installed on the car
+        # Find the spares installed on the car. The query only collects keys,
+        # each transaction reads the spares itself and skips any that moved.
         spares_query = client.query(kind="spares")
         spares_query.add_filter("car_id", "=", car_id)
-        all_spares = list(spares_query.fetch())
+        spares_query.keys_only()
+        spare_keys = [spare.key for spare in spares_query.fetch()]
+
+        # Remove the spares from the car and delete the car in one transaction.
+        # A commit holds at most datastore_max_batch_size mutations, so only a
+        # car with more spares than that needs extra commits to detach the rest.
+        # Besides the spares, a commit deletes the car and its name reservation
+        # and updates up to three counters.
+        batches = list(datastore_helper.chunks(spare_keys, constants.datastore_max_batch_size - 5)) or [[]]
+
+        # Every commit checks the precondition, and detaching spares doesn't
+        # change the car's ETag, so a conditional delete of a car that changed
+        # fails before any of its spares are detached.
+        expected_etag = etag if request.if_match else None
+        error = None
+        for batch in batches[:-1]:
+            error = datastore_helper.run_in_transaction(client, detach_spares_from_car, car, batch, expected_etag)
+            if error:
+                break
+        else:
+            error = datastore_helper.run_in_transaction(client, put_spares_and_delete_car, batches[-1], car,
+                                                        expected_etag)
+        entity_cache.invalidate(car.key, *spare_keys)
+        if error:
+            return error
+        return "", 204
 
-        # Remove the spares from the car
-        if all_spares.__len__() > 0:
-            for spare in all_spares:
-                spare["car_id"] = None
-                client.put(spare)
 
-        # Delete car
-        client.delete(car)
-        return "", 204
+def car_response(car_id, car, installed_spares, fields, etag):
+    return etag_helper.with_etag(response_helper.json_response(fields_helper.select(
+        response_helper.entity_to_dict(car, id=car_id, spares=installed_spares, self=request.base_url), fields)),
+        etag)
+
+
+def update_car(car_id, car, validate):
+    # PUT or PATCH the car with the request body
+    content = request.get_json()
+    validate(content)
+
+    error = save_car(car, content)
+    if error:
+        return error
+
+    return etag_helper.with_etag(response_helper.json_response(
+        response_helper.entity_to_dict(car, id=car_id, self=request.base_url)), get_car_etag(car))
+
+
+def detach_spares(spares):
+    # Runs in a transaction. Removes the spares from their car, which moves
+    # them from the installed to the free spares counter.
+    deltas = {}
+    for spare in spares:
+        counter_helper.count_spare(deltas, spare, -1)
+        datastore_helper.set_installed_car(spare, None)
+        datastore_helper.bump_version(spare)
+        counter_helper.count_spare(deltas, spare, 1)
+    client.put_multi(spares)
+    counter_helper.apply(deltas)
+
+
+def detach_spares_from_car(car, spare_keys, expected_etag=None):
+    # Runs in a transaction. The car and the spares are read again, so a
+    # retried transaction starts from the stored spares and not from the
+    # copies a failed attempt already changed.
+    entities = {entity.key: entity for entity in client.get_multi([car.key] + spare_keys)}
+    error = check_stored_car(entities.pop(car.key, None), expected_etag)
+    if error:
+        return error
+
+    detach_spares(get_spares_on_car(datastore_helper.key_id(car.key), list(entities.values())))
+
+
+def check_stored_car(stored_car, expected_etag=None):
+    # Returns an error response when the car was deleted, or changed since
+    # expected_etag was read for a conditional request
+    if stored_car is None:
+        return {"Error": constants.car_not_found_error}, 404
+    if expected_etag is not None and get_car_etag(stored_car) != expected_etag:
+        return {"Error": constants.precondition_failed_error}, 412
+
+
+def get_spares_on_car(car_id, spares):
+    # A spare found by a query may have been moved to another car since
+    return [spare for spare in spares if spare.get("car_id") == car_id]
+
+
+def put_spares_and_delete_car(spare_keys, car, expected_etag=None):
+    # Runs in a transaction. Returns an error response when the car changed
+    # since it was read for a conditional request. The car and its spares are
+    # read again in one lookup, so a concurrent delete isn't counted twice.
+    entities = {entity.key: entity for entity in client.get_multi([car.key] + spare_keys)}
+    stored_car = entities.pop(car.key, None)
+    error = check_stored_car(stored_car, expected_etag)
+    if error:
+        return error
+
+    detach_spares(get_spares_on_car(datastore_helper.key_id(car.key), list(entities.values())))
+    client.delete(car.key)
+    # Release the name the car holds now, which a concurrent rename may have
+    # changed since the car was read
+    client.delete(get_name_reservation_key(stored_car["name"]))
+    counter_helper.apply(counter_helper.count_car({}, stored_car, -1))
+
+
+def save_car(car, content):
+    # Apply a PUT or PATCH body and write the car. The body is applied to the
+    # car read in the write's transaction, so the new version always follows
+    # the one it replaces. Returns an error response or None.
+    expected_etag = get_car_etag(car)
+    etag_helper.check_if_match(expected_etag)
+
+    error = datastore_helper.run_in_transaction(client, put_car_update, car, content,
+                                                expected_etag if request.if_match else None)
+    entity_cache.invalidate(car.key)
+    return error
+
+
+def put_car_update(car, content, expected_etag=None):
+    # Runs in a transaction. Returns an error response when the car changed
+    # since expected_etag was read, was deleted, or another car holds the new
+    # name. On success car holds what was written.
+    name = content.get("name", car["name"])
+    reservation_key = get_name_reservation_key(name) if name != car["name"] else None
+
+    # The stored car and the name reservation are read in one lookup
+    keys = [car.key] + ([reservation_key] if reservation_key is not None else [])
+    entities = {entity.key: entity for entity in client.get_multi(keys)}
+    stored_car = entities.get(car.key)
+    if stored_car is None:
+        return {"Error": constants.car_not_found_error}, 404
+    if expected_etag is not None and get_car_etag(stored_car) != expected_etag:
+        return {"Error": constants.precondition_failed_error}, 412
+
+    # A concurrent rename may have changed the name the car holds since it was
+    # read. That name is the one released.
+    name = content.get("name", stored_car["name"])
+    if name != stored_car["name"]:
+        new_key = get_name_reservation_key(name)
+        taken = new_key in entities if new_key == reservation_key else client.get(new_key) is not None
+        if taken:
+            return {"Error": constants.car_with_name_exists_error.format(name)}, 403
+
+        client.put(datastore.Entity(key=new_key))
+        client.delete(get_name_reservation_key(stored_car["name"]))
+
+    datastore_helper.update_entity(stored_car, content)
+    client.put(stored_car)
+    car.clear()
+    car.update(stored_car)
+
+
+def put_new_car(car):
+    # Runs in a transaction. Reserves the name, writes the car and counts it.
+    error = reserve_name_and_put_car(car)
+    if not error:
+        counter_helper.apply(counter_helper.count_car({}, car, 1))
+    return error
+
+
+def reserve_name_and_put_car(car):
+    # Runs in a transaction. Returns an error response when another car holds
+    # the name.
+    reservation_key = get_name_reservation_key(car["name"])
+    if client.get(reservation_key) is not None:
+        return {"Error": constants.car_with_name_exists_error.format(car["name"])}, 403
+
+    client.put_multi([datastore.Entity(key=reservation_key), car])
+
+
+def get_car_etag(car):
+    return etag_helper.make_etag("car", datastore_helper.key_id(car.key), car.get("version", 0))
+
+
+def reserve_names_and_put_cars(cars):
+    # Runs in a transaction. Returns the names other cars already hold. The
+    # remaining cars get their names reserved, are written and counted.
+    names = {get_name_reservation_key(car["name"]): car["name"] for car in cars}
+    taken = {names[reservation.key] for reservation in client.get_multi(list(names))}
+
+    free_cars = [car for car in cars if car["name"] not in taken]
+    client.put_multi([datastore.Entity(key=get_name_reservation_key(car["name"])) for car in free_cars] + free_cars)
+
+    deltas = {}
+    for car in free_cars:
+        counter_helper.count_car(deltas, car, 1)
+    counter_helper.apply(deltas)
+    return taken
+
+
+def build_car(key, content, user_id):
+    car = datastore.Entity(key=key)
+    car.update({
+        "name": content["name"],
+        "model": content["model"],
+        "reg_num": content["reg_num"],
+        "color": content["color"],
+        "user_id": user_id
+    })
+    datastore_helper.bump_version(car)
+    return car
+
+
+def get_name_reservation_key(name):
+    # Car names are reserved by an entity keyed by the name, so checking
+    # uniqueness is a strongly consistent lookup by key. Datastore rejects an
+    # empty key name and names like __x__, which are valid car names, so the
+    # key name is the car name behind a prefix.
+    return client.key('car_names', "name:" + name)
 
 
 def install_and_remove_spare(car_id, spare_id):
@@ -199,158 +419,236 @@ def install_and_remove_spare(car_id, spare_id):
     spare_id = int(spare_id)
 
     if request.method == 'PUT':
-        # Check if the car exists
-        car_key = client.key('cars', int(car_id))
-        car = client.get(key=car_key)
-        if car is None:
-            return {"Error": constants.car_not_found_error}, 404
-
-        # Check if the spare exists
-        spare_key = client.key('spares', int(spare_id))
-        spare = client.get(key=spare_key)
-        if spare is None:
-            return {"Error": constants.spare_not_found_error}, 404
-
-        # Check if the spare is already assigned to a car
-        if "car_id" in spare and spare["car_id"] is not None:
-            return {"Error": constants.spare_installed_error}, 403
-
-        # Assign spare to the car
-        spare["car_id"] = car_id
-        client.put(spare)
-        return "", 204
+        response = datastore_helper.run_in_transaction(client, install_spare, car_id, spare_id)
 
     elif request.method == 'DELETE':
-        # Check if the car exists
-        car_key = client.key('cars', int(car_id))
-        car = client.get(key=car_key)
-        if car is None:
-            return {"Error": constants.car_not_found_error}, 404
+        response = datastore_helper.run_in_transaction(client, remove_spare, car_id, spare_id)
 
-        # Check if the spare exists
-        spare_key = client.key('spares', int(spare_id))
-        spare = client.get(key=spare_key)
-        if spare is None:
-            return {"Error": constants.spare_not_found_error}, 404
+    # Both the car and the spare got a new version
+    entity_cache.invalidate(client.key('cars', car_id), client.key('spares', spare_id))
+    return response
 
-        # Check if the spare is installed on the car
-        if "car_id" not in spare or spare["car_id"] is None or spare["car_id"] != car_id:
-            return {"Error": constants.car_not_installed_with_spare_error}, 403
 
-        spare["car_id"] = None
-        client.put(spare)
-        return "", 204
+def install_and_remove_spares(car_id):
+    car_id = int(car_id)
+    validate_content_type()
 
+    payload = verify_jwt(request)
+    user_id = payload["sub"]
 
-def get_spares_for_car(car_id):
-    # Get spares that are installed on the car
-    spares_query = client.query(kind="spares")
-    spares_query.add_filter("car_id", "=", car_id)
-    all_spares = list(spares_query.fetch())
-    installed_spares = []
-
-    for spare in all_spares:
-        self = request.host_url + "spares/{0}".format(spare.key.id)
-        installed_spares.append({
-            "id": spare.key.id,
-            "self": self
-        })
-    return installed_spares
+    spare_ids = get_spare_ids(request.get_json())
 
+    # All spares are installed or removed in one transaction, or none are
+    if request.method == 'PUT':
+        response = datastore_helper.run_in_transaction(client, install_spares, car_id, spare_ids, user_id)
 
-def perform_basic_validations(car_id):
-    payload = verify_jwt(request)
-    user_id = payload["sub"]
+    elif request.method == 'DELETE':
+        response = datastore_helper.run_in_transaction(client, remove_spares, car_id, spare_ids, user_id)
 
-    car_key = client.key('cars', int(car_id))
-    car = client.get(key=car_key)
+    entity_cache.invalidate(client.key('cars', car_id), *[client.key('spares', spare_id) for spare_id in spare_ids])
+    return response
+
+
+def install_spares(car_id, spare_ids, user_id):
+    car, spares = get_car_and_spares(car_id, spare_ids, user_id)
+
+    # Check if any spare is already assigned to a car
+    installed_ids = [datastore_helper.key_id(spare.key) for spare in spares if spare.get("car_id") is not None]
+    if installed_ids:
+        raise AuthError({"Error": constants.spare_installed_error, "spare_ids": installed_ids}, 403)
+
+    deltas = {}
+    for spare in spares:
+        counter_helper.count_spare(deltas, spare, -1)
+        datastore_helper.set_installed_car(spare, car_id)
+        datastore_helper.bump_version(spare)
+        counter_helper.count_spare(deltas, spare, 1)
+    datastore_helper.bump_version(car)
+    client.put_multi(spares + [car])
+    counter_helper.apply(deltas)
+    return "", 204
+
+
+def remove_spares(car_id, spare_ids, user_id):
+    car, spares = get_car_and_spares(car_id, spare_ids, user_id)
+
+    # Check if every spare is installed on the car
+    other_ids = [datastore_helper.key_id(spare.key) for spare in spares if spare.get("car_id") != car_id]
+    if other_ids:
+        raise AuthError({"Error": constants.car_not_installed_with_spare_error, "spare_ids": other_ids}, 403)
+
+    detach_spares(spares)
+    datastore_helper.bump_version(car)
+    client.put_multi([car])
+    return "", 204
+
+
+def install_spare(car_id, spare_id):
+    car, spare = get_car_and_spare(car_id, spare_id)
+
+    # Check if the car exists
+    if car is None:
+        return {"Error": constants.car_not_found_error}, 404
+
+    # Check if the spare exists
+    if spare is None:
+        return {"Error": constants.spare_not_found_error}, 404
+
+    # Check if the spare is already assigned to a car
+    if "car_id" in spare and spare["car_id"] is not None:
+        return {"Error": constants.spare_installed_error}, 403
+
+    # Assign spare to the car. The car gets a new version too since its list
+    # of spares changes.
+    deltas = counter_helper.count_spare({}, spare, -1)
+    datastore_helper.set_installed_car(spare, car_id)
+    datastore_helper.bump_version(spare)
+    datastore_helper.bump_version(car)
+    client.put_multi([spare, car])
+    counter_helper.apply(counter_helper.count_spare(deltas, spare, 1))
+    return "", 204
+
+
+def remove_spare(car_id, spare_id):
+    car, spare = get_car_and_spare(car_id, spare_id)
+
+    # Check if the car exists
+    if car is None:
+        return {"Error": constants.car_not_found_error}, 404
+
+    # Check if the spare exists
+    if spare is None:
+        return {"Error": constants.spare_not_found_error}, 404
+
+    # Check if the spare is installed on the car
+    if "car_id" not in spare or spare["car_id"] is None or spare["car_id"] != car_id:
+        return {"Error": constants.car_not_installed_with_spare_error}, 403
+
+    detach_spares([spare])
+    datastore_helper.bump_version(car)
+    client.put(car)
+    return "", 204
+
+
+def get_car_and_spare(car_id, spare_id):
+    # Fetch the car and the spare in a single lookup
+    car_key = client.key('cars', car_id)
+    spare_key = client.key('spares', spare_id)
+    entities = {entity.key: entity for entity in client.get_multi([car_key, spare_key])}
+    return entities.get(car_key), entities.get(spare_key)
+
+
+def get_car_and_spares(car_id, spare_ids, user_id):
+    # Fetch the car and all the spares in a single lookup
+    car_key = client.key('cars', car_id)
+    spare_keys = [client.key('spares', spare_id) for spare_id in spare_ids]
+    entities = {entity.key: entity for entity in client.get_multi([car_key] + spare_keys)}
+
+    car = entities.get(car_key)
     if car is None:
         raise AuthError({"Error": constants.car_not_found_error}, 404)
 
     if car["user_id"] != user_id:
         raise AuthError({"Error": "Invalid user. The car_id belongs to a different user"}, 403)
 
-    return car
+    missing_ids = [spare_id for spare_id, key in zip(spare_ids, spare_keys) if key not in entities]
+    if missing_ids:
+        raise AuthError({"Error": constants.spare_not_found_error, "spare_ids": missing_ids}, 404)
 
+    return car, [entities[key] for key in spare_keys]
 
-def validate_content_type():
-    # Check if the content type header has the supported type
-    content_type = request.headers.get('Content-Type')
-    if content_type != 'application/json':
-        raise AuthError({"Error": constants.content_type_error}, 415)
 
+def get_spare_ids(content):
+    # The body is {"spare_ids": [...]}. The spares, the car and the installed
+    # and free spares counters must fit in one commit.
+    max_spares = constants.datastore_max_batch_size - 3
+    spare_ids = content.get("spare_ids") if isinstance(content, dict) else None
+    if not isinstance(spare_ids, list) or not 0 < len(spare_ids) <= max_spares \
+            or not all(isinstance(spare_id, int) and not isinstance(spare_id, bool) for spare_id in spare_ids):
+        raise AuthError({"Error": constants.spare_ids_error.format(max_spares)}, 400)
 
-def validate_accept_header():
-    accept = request.headers.get('Accept')
-    if accept != "application/json":
-        raise AuthError({
-            "Error": "Accept header {0} is not supported. Valid accept header is: application/json"
-            .format(accept)
-        }, 406)
+    # Drop duplicates, keeping the order
+    return list(dict.fromkeys(spare_ids))
 
 
-def validate_car_request_body(content):
-    # Check if all attributes are present
-    if ("name" not in content) or ("model" not in content) or ("reg_num" not in content) \
-            or ("color" not in content):
-        raise AuthError({"Error": constants.missing_attributes_error}, 400)
+def get_spares_for_car(car_id):
+    # Get spares that are installed on the car
+    return get_spares_for_cars([car_id])[car_id]
 
-    validate_name(content)
-    validate_model(content)
-    validate_reg_num(content)
-    validate_color(content)
 
+def get_spares_for_cars(car_ids):
+    # Get spares that are installed on any of the cars, grouped by car id.
+    # One IN query per chunk of car ids instead of one query per car.
+    spares = []
+    for chunk in datastore_helper.chunks(car_ids, constants.datastore_max_in_filter_values):
+        spares.extend(query_spares_for_cars(chunk))
+    return group_spares_by_car(car_ids, spares)
 
-def validate_car_request_body_for_patch(content):
-    # Check if id is present in the request body
-    if "id" in content:
-        return {"Error": "Attribute 'Id' cannot be updated."}
 
-    # Check if all attributes are not present
-    if {"name", "model", "reg_num", "color"} <= content.keys():
-        raise AuthError({"Error": constants.all_attributes_error}, 400)
+def query_spares_for_cars(car_ids):
+    # Spares installed on at most datastore_max_in_filter_values cars
+    spares_query = client.query(kind="spares")
+    if len(car_ids) == 1:
+        spares_query.add_filter("car_id", "=", car_ids[0])
+    else:
+        spares_query.add_filter("car_id", "IN", car_ids)
+    return list(spares_query.fetch())
+
+
+def group_spares_by_car(car_ids, spares):
+    installed_spares = {car_id: [] for car_id in car_ids}
+    for spare in spares:
+        spare_id = datastore_helper.key_id(spare.key)
+        self = request.host_url + "spares/{0}".format(spare_id)
+        installed_spares[spare["car_id"]].append({
+            "id": spare_id,
+            "self": self
+        })
+    return installed_spares
 
-    validate_name(content)
-    validate_model(content)
-    validate_reg_num(content)
-    validate_color(content)
 
+def perform_basic_validations(car_id, cached=False):
+    payload = verify_jwt(request)
+    user_id = payload["sub"]
 
-def validate_name(content):
-    # Check if the name attribute is a string
-    if "name" in content and not isinstance(content["name"], str):
-        raise AuthError({"Error": constants.name_attribute_error}, 400)
+    # Only reads may come from the cache. Writes start from the stored car.
+    car_key = client.key('cars', int(car_id))
+    if cached:
+        car = entity_cache.get(car_key)
+    else:
+        car = client.get(key=car_key)
 
-    # Check if the name attribute has more than 100 characters
-    if "name" in content and len(content["name"]) > constants.attribute_max_length:
-        raise AuthError({"Error": constants.attribute_length_error.format("name")}, 400)
+    check_car(car, user_id)
+    return car
 
 
-def validate_model(content):
-    # Check if the type attribute is a string
-    if "model" in content and not isinstance(content["model"], str):
-        raise AuthError({"Error": constants.model_attribute_error}, 400)
+def check_car(car, user_id):
+    if car is None:
+        raise AuthError({"Error": constants.car_not_found_error}, 404)
 
-    # Check if the model attribute has more than 100 characters
-    if "model" in content and len(content["model"]) > constants.attribute_max_length:
-        raise AuthError({"Error": constants.attribute_length_error.format("model")}, 400)
+    if car["user_id"] != user_id:
+        raise AuthError({"Error": "Invalid user. The car_id belongs to a different user"}, 403)
 
 
-def validate_reg_num(content):
-    # Check if the reg_num attribute is a string
-    if "reg_num" in content and not isinstance(content["reg_num"], str):
-        raise AuthError({"Error": constants.reg_num_attribute_error}, 400)
+# Request body rules for cars, compiled once into single-pass validators
+car_schema = {
+    "name": validation_helper.Field(str, constants.name_attribute_error,
+                                    constants.attribute_max_length, constants.attribute_length_error.format("name")),
+    "model": validation_helper.Field(str, constants.model_attribute_error,
+                                     constants.attribute_max_length, constants.attribute_length_error.format("model")),
+    "reg_num": validation_helper.Field(str, constants.reg_num_attribute_error,
+                                       constants.reg_num_max_length, constants.reg_num_max_length_error),
+    "color": validation_helper.Field(str, constants.color_attribute_error,
+                                     constants.attribute_max_length, constants.attribute_length_error.format("color")),
+}
+car_server_attributes = ("id", "user_id", "version", "self")
+validate_car = validation_helper.compile_schema(car_schema, immutable=car_server_attributes)
+validate_car_patch = validation_helper.compile_schema(car_schema, partial=True, immutable=car_server_attributes)
 
-    # Check if the reg_num attribute has more than 10 characters
-    if "reg_num" in content and len(content["reg_num"]) > constants.reg_num_max_length:
-        raise AuthError({"Error": constants.reg_num_max_length_error}, 400)
 
+def validate_car_request_body(content):
+    validation_helper.check(validate_car, content)
 
-def validate_color(content):
-    # Check if the color attribute is a string
-    if "color" in content and not isinstance(content["color"], str):
-        raise AuthError({"Error": constants.color_attribute_error}, 400)
 
-    # Check if the color attribute has more than 100 characters
-    if "color" in content and len(content["color"]) > constants.attribute_max_length:
-        raise AuthError({"Error": constants.attribute_length_error.format("color")}, 400)
+def validate_car_request_body_for_patch(content):
+    validation_helper.check(validate_car_patch, content)
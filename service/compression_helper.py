@@ -0,0 +1,100 @@
+import zlib
+
+from flask import request
+
+from constants import constants
+from monitoring.timing import span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def compress_response(response):
+    # after_request hook. Compresses JSON and NDJSON bodies with the encoding
+    # the client prefers in Accept-Encoding: br when brotli is installed, else
+    # gzip. Responses with an ETag are left alone so the ETag keeps naming a
+    # single representation, and bodies below the size threshold aren't worth
+    # the CPU.
+    if response.mimetype not in constants.compressible_mimetypes:
+        return response
+    response.vary.add("Accept-Encoding")
+
+    if response.status_code < 200 or response.status_code in (204, 304) or "Content-Encoding" in response.headers \
+            or "ETag" in response.headers:
+        return response
+
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # Each chunk the generator yields is compressed and flushed, so the
+        # client still receives batches as they are read
+        response.response = compress_stream(response.response, encoding)
+    else:
+        data = response.get_data()
+        if len(data) < constants.COMPRESSION_MIN_SIZE:
+            return response
+        with span("compress." + encoding):
+            compressor = make_compressor(encoding)
+            response.set_data(compressor.compress(data) + compressor.finish())
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def choose_encoding():
+    # The supported encoding with the highest quality, br on a tie
+    accept = request.accept_encodings
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = max(candidates, key=lambda encoding: accept.quality(encoding))
+    return best if accept.quality(best) > 0 else None
+
+
+def compress_stream(chunks, encoding):
+    compressor = make_compressor(encoding)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def make_compressor(encoding):
+    if encoding == "br":
+        return BrotliCompressor(constants.BROTLI_QUALITY)
+    return GzipCompressor(constants.COMPRESSION_LEVEL)
+
+
+class GzipCompressor:
+    def __init__(self, level):
+        # wbits 31 writes a gzip header and trailer
+        self.wrapped = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.wrapped.compress(data)
+
+    def flush(self):
+        return self.wrapped.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.wrapped.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, quality):
+        self.wrapped = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.wrapped.process(data)
+
+    def flush(self):
+        return self.wrapped.flush()
+
+    def finish(self):
+        return self.wrapped.finish()
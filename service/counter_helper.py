@@ -0,0 +1,79 @@
+import random
+
+from google.cloud import datastore
+
+from constants import constants
+from service import datastore_helper
+from storage.backend import client
+
+# Sharded counters. Each counter is the sum of counter_shard_count shard
+# entities, so concurrent writers rarely update the same entity. A shard holds
+# a count and a value, e.g. the number of free spares and their total price.
+INSTALLED_SPARES = "spares:installed"
+FREE_SPARES = "spares:free"
+
+
+def car_counter(user_id):
+    return "cars:{0}".format(user_id)
+
+
+def spare_counter(spare):
+    return INSTALLED_SPARES if spare.get("car_id") is not None else FREE_SPARES
+
+
+def add(deltas, name, count, value=0):
+    # Add to the pending changes of a counter. deltas maps counter names to
+    # [count, value] and is written with apply().
+    delta = deltas.setdefault(name, [0, 0])
+    delta[0] += count
+    delta[1] += value
+    return deltas
+
+
+def count_car(deltas, car, sign):
+    # sign is 1 for a new car and -1 for a deleted one
+    return add(deltas, car_counter(car["user_id"]), sign)
+
+
+def count_spare(deltas, spare, sign):
+    # A spare counts towards the installed or the free spares, depending on
+    # its car_id. A spare that moves is counted -1 before and 1 after the change.
+    return add(deltas, spare_counter(spare), sign, sign * spare.get("price", 0))
+
+
+def shard_key(name, shard):
+    return client.key("counter_shards", "{0}#{1}".format(name, shard))
+
+
+def apply(deltas):
+    # Runs in the transaction of the write that is counted, so a counter
+    # changes if and only if the write commits. Each counter updates one random
+    # shard: one lookup and at most one mutation per counter.
+    changes = [(name, delta) for name, delta in deltas.items() if delta != [0, 0]]
+    if not changes:
+        return
+
+    keys = [shard_key(name, random.randrange(constants.counter_shard_count)) for name, _ in changes]
+    shards = {shard.key: shard for shard in client.get_multi(keys)}
+
+    updated = []
+    for key, (_, (count_delta, value_delta)) in zip(keys, changes):
+        shard = shards.get(key)
+        if shard is None:
+            shard = datastore.Entity(key=key, exclude_from_indexes=("count", "value"))
+        shard["count"] = shard.get("count", 0) + count_delta
+        shard["value"] = shard.get("value", 0) + value_delta
+        updated.append(shard)
+    client.put_multi(updated)
+
+
+def read(*names):
+    # Sum the shards of every counter in one lookup. Returns
+    # {name: {"count": ..., "value": ...}}.
+    keys = [shard_key(name, shard) for name in names for shard in range(constants.counter_shard_count)]
+    totals = {name: {"count": 0, "value": 0} for name in names}
+    for shard in client.get_multi(keys):
+        name = datastore_helper.key_id(shard.key).rsplit("#", 1)[0]
+        totals[name]["count"] += shard.get("count", 0)
+        totals[name]["value"] += shard.get("value", 0)
+    return totals
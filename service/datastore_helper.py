@@ -0,0 +1,53 @@
+import time
+
+from google.api_core import exceptions
+
+from constants import constants
+
+
+def run_in_transaction(client, func, *args):
+    # Run func inside a Datastore transaction, retrying it when the commit
+    # loses to a concurrent transaction. The transaction only begins with the
+    # first lookup, so a read-then-write costs a lookup and a commit.
+    for attempt in range(constants.transaction_max_retries + 1):
+        try:
+            with client.transaction(begin_later=True):
+                return func(*args)
+        except exceptions.Conflict:
+            if attempt == constants.transaction_max_retries:
+                raise
+            time.sleep(constants.transaction_retry_delay * 2 ** attempt)
+
+
+def key_id(key):
+    # Same as key.id for a complete key. Key.id deep-copies the key path on
+    # every access, which adds up on list pages.
+    return key.flat_path[-1]
+
+
+def chunks(items, size):
+    # Split a list into consecutive slices of at most size items
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bump_version(entity):
+    # Stamp a new version on an entity before it is written. ETags are built
+    # from it.
+    entity["version"] = entity.get("version", 0) + 1
+
+
+def set_installed_car(spare, car_id):
+    # Install a spare on a car, or remove it with None. installed mirrors
+    # car_id as an equality filter, since car_id != None is an inequality and
+    # Datastore allows inequalities on one property per query only.
+    spare["car_id"] = car_id
+    spare["installed"] = car_id is not None
+
+
+def update_entity(entity, content):
+    # Apply a request body to an entity and stamp a new version. The version is
+    # read before the update so a body can't set it.
+    version = entity.get("version", 0)
+    entity.update(content)
+    entity["version"] = version + 1
@@ -0,0 +1,33 @@
+from flask import current_app as app
+from flask import request
+
+from auth.auth_helper import AuthError
+from constants import constants
+
+
+def make_etag(*parts):
+    # Strong validator built from entity ids and version stamps. Every write
+    # bumps the version, so equal ETags mean byte-identical bodies.
+    return "-".join(str(part) for part in parts)
+
+
+def is_fresh(etag):
+    # True when the client's cached copy (If-None-Match) is still current
+    return request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def check_if_match(etag):
+    # Reject a write made against an out of date copy (If-Match)
+    if request.if_match and not request.if_match.contains(etag):
+        raise AuthError({"Error": constants.precondition_failed_error}, 412)
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,25 @@
+from flask import current_app as app
+
+from constants import constants
+from service import pagination_helper, response_helper
+
+
+def ndjson_response(query, cursor, to_dict):
+    # Stream every result of the query as one JSON object per line. Results
+    # are read a batch at a time with query cursors, so memory use does not
+    # grow with the dataset. After each batch a {"next_cursor": ...} line
+    # tells the client where to resume with ?cursor= if the connection drops.
+    # The last line has a null next_cursor.
+    def generate(items, next_cursor):
+        while True:
+            yield b"".join(response_helper.dumps(to_dict(item)) + b"\n" for item in items)
+            yield response_helper.dumps({"next_cursor": next_cursor}) + b"\n"
+
+            if not next_cursor:
+                return
+            items, next_cursor = pagination_helper.fetch_page(query, constants.export_batch_size, next_cursor)
+
+    # The first batch is read before the response starts, so a bad cursor
+    # still gets a proper error response
+    items, next_cursor = pagination_helper.fetch_page(query, constants.export_batch_size, cursor)
+    return app.response_class(generate(items, next_cursor), mimetype='application/x-ndjson')
@@ -0,0 +1,50 @@
+from flask import request
+
+from auth.auth_helper import AuthError
+from constants import constants
+from service import etag_helper
+
+
+def get_fields(allowed):
+    # Parse ?fields=id,name into a set of field names. None means every field.
+    value = request.args.get("fields")
+    if value is None:
+        return None
+
+    fields = {name.strip() for name in value.split(",") if name.strip()}
+    if not fields or not fields <= allowed:
+        raise AuthError({"Error": constants.invalid_query_param_error.format("fields")}, 400)
+    return fields
+
+
+def wants(fields, name):
+    return fields is None or name in fields
+
+
+def select(body, fields):
+    # Trim a response body to the requested fields
+    if fields is None:
+        return body
+    return {name: value for name, value in body.items() if name in fields}
+
+
+def apply_projection(query, fields, properties, projectable):
+    # Read only what the fields need: keys when no stored property is asked
+    # for, and a projection when a single indexed property is. A projection
+    # skips entities without the property, so only properties every entity
+    # has are projectable.
+    if fields is None:
+        return
+
+    needed = fields & properties
+    if not needed:
+        query.keys_only()
+    elif len(needed) == 1 and needed <= projectable:
+        query.projection = list(needed)
+
+
+def fields_etag(etag, fields):
+    # A trimmed body is a different representation with its own ETag
+    if fields is None:
+        return etag
+    return etag_helper.make_etag(etag, "fields", *sorted(fields))
@@ -0,0 +1,87 @@
+import base64
+import binascii
+import math
+from urllib.parse import urlencode
+
+from flask import request
+from google.api_core import exceptions
+
+from auth.auth_helper import AuthError
+from constants import constants
+
+
+def get_page_params(default_limit=constants.page_default_limit):
+    limit = parse_int_arg("limit", default_limit)
+    if limit < 1 or limit > constants.page_max_limit:
+        raise AuthError({"Error": constants.page_limit_error.format(constants.page_max_limit)}, 400)
+
+    cursor = get_cursor()
+
+    # Deprecated: offset paging makes Datastore scan and discard every skipped
+    # entity. It is only honoured when no cursor is given.
+    offset = parse_int_arg("offset", 0)
+    if offset < 0:
+        raise AuthError({"Error": constants.invalid_query_param_error.format("offset")}, 400)
+
+    return limit, cursor, offset
+
+
+def get_cursor():
+    cursor = request.args.get("cursor")
+    if cursor:
+        validate_cursor(cursor)
+    return cursor
+
+
+def fetch_page(query, limit, cursor=None, offset=0):
+    # Returns one page of results and the opaque cursor for the next page
+    try:
+        if cursor:
+            iterator = query.fetch(limit=limit, start_cursor=cursor)
+        else:
+            iterator = query.fetch(limit=limit, offset=offset)
+        items = list(next(iterator.pages))
+    except exceptions.BadRequest:
+        # Datastore rejects cursors that decode but don't belong to the query
+        if not cursor:
+            raise
+        raise AuthError({"Error": constants.invalid_query_param_error.format("cursor")}, 400)
+    next_cursor = iterator.next_page_token
+    if isinstance(next_cursor, bytes):
+        next_cursor = next_cursor.decode("ascii")
+
+    return items, next_cursor
+
+
+def next_page_url(limit, next_cursor, **args):
+    params = dict(args)
+    params.update({"limit": limit, "cursor": next_cursor})
+    return request.base_url + "?" + urlencode(params)
+
+
+def validate_cursor(cursor):
+    try:
+        base64.urlsafe_b64decode(cursor.encode("ascii"))
+    except (UnicodeEncodeError, binascii.Error, ValueError):
+        raise AuthError({"Error": constants.invalid_query_param_error.format("cursor")}, 400)
+
+
+def parse_int_arg(name, default):
+    try:
+        return int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        raise AuthError({"Error": constants.invalid_query_param_error.format(name)}, 400)
+
+
+def parse_float_arg(name):
+    # None when the query parameter is not given
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        number = math.nan
+    if not math.isfinite(number):
+        raise AuthError({"Error": constants.invalid_query_param_error.format(name)}, 400)
+    return number
@@ -0,0 +1,35 @@
+import json
+
+from flask import current_app as app
+
+from monitoring.timing import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value):
+    # Encode straight to bytes. Entities are dicts, so both encoders serialize
+    # them without conversion.
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def json_response(body, status_code=200):
+    with span("json.encode"):
+        data = dumps(body)
+    return app.response_class(data, status=status_code, mimetype='application/json')
+
+
+def entity_to_dict(entity, **fields):
+    # Response body for an entity plus extra fields like id and self. The
+    # entity itself is left untouched and its version stamp and the spares'
+    # installed flag are not exposed.
+    body = dict(entity)
+    body.pop("version", None)
+    body.pop("installed", None)
+    body.update(fields)
+    return body
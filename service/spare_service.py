@@ -1,13 +1,16 @@
 import datetime
-import json
 
-from flask import request, current_app as app
+from flask import request
 from google.cloud import datastore
 
 from auth.auth_helper import AuthError
 from constants import constants
-
-client = datastore.Client()
+from service import (
+    batch_helper, counter_helper, datastore_helper, etag_helper, export_helper, fields_helper, pagination_helper,
+    response_helper, validation_helper,
+)
+from service.validation_helper import validate_accept_header, validate_content_type
+from storage.backend import client, entity_cache
 
 
 def get_all_and_create_spare():
@@ -20,14 +23,8 @@ def get_all_and_create_spare():
         validate_spare_request_body(content)
 
         # Add spare to datastore
-        new_spare = datastore.Entity(key=client.key('spares'))
-        new_spare.update({
-            "name": content["name"],
-            "price": content["price"],
-            "manu_date": str(datetime.datetime.now()),
-            "serial_num": content["serial_num"]
-        })
-        client.put(new_spare)
+        new_spare = build_spare(client.key('spares'), content)
+        datastore_helper.run_in_transaction(client, put_new_spares, [new_spare])
 
         self = request.base_url + "/{0}".format(new_spare.key.id)
 
@@ -40,68 +37,110 @@ def get_all_and_create_spare():
             "self": self
         }
 
-        response = app.make_response(json.dumps(response))
-        response.mimetype = 'application/json'
-        response.status_code = 201
-        return response
+        return etag_helper.with_etag(response_helper.json_response(response, 201), get_spare_etag(new_spare))
 
     elif request.method == 'GET':
         validate_accept_header()
 
+        # The list has no installed_car, only the car_id
+        fields = fields_helper.get_fields(constants.spare_fields - {"installed_car"})
+
         spares_query = client.query(kind="spares")
-        limit = int(request.args.get('limit', '5'))
-        offset = int(request.args.get('offset', '0'))
-        left_iterator = spares_query.fetch(limit=limit, offset=offset)
-        pages = left_iterator.pages
-        all_spares = list(next(pages))
+        filtered = apply_spare_filters(spares_query)
+
+        # A projection alongside filters or a sort order would need an index
+        # per combination, so filtered pages read keys or full entities
+        projectable = set() if filtered else constants.spare_projection_properties
+        fields_helper.apply_projection(spares_query, fields, constants.spare_properties, projectable)
+        limit, cursor, offset = pagination_helper.get_page_params()
+        all_spares, next_cursor = pagination_helper.fetch_page(spares_query, limit, cursor, offset)
 
         # If there are no spares, return an empty list
         if len(all_spares) == 0:
             return {"spares": []}, 200
 
-        if left_iterator.next_page_token:
-            next_offset = offset + limit
-            next_url = request.base_url + "?limit=" + str(limit) + "&offset=" + str(next_offset)
+        if next_cursor:
+            args = {name: request.args[name] for name in constants.spare_query_params if name in request.args}
+            next_url = pagination_helper.next_page_url(limit, next_cursor, **args)
         else:
             next_url = None
 
+        output = {"spares": []}
         for spare in all_spares:
-            spare["id"] = spare.key.id
-            spare["self"] = request.base_url + "/" + str(spare.key.id)
-
-        output = {"spares": all_spares}
+            spare_id = datastore_helper.key_id(spare.key)
+            output["spares"].append(fields_helper.select(
+                response_helper.entity_to_dict(spare, id=spare_id, self=request.base_url + "/" + str(spare_id)),
+                fields))
 
         if next_url:
             output["next"] = next_url
 
-        response = app.make_response(json.dumps(output))
-        response.mimetype = 'application/json'
-        response.status_code = 200
-        return response
+        return response_helper.json_response(output)
 
     else:
         return {"Error": "Method not supported!"}, 405
 
 
+def create_spares_batch():
+    validate_content_type()
+
+    # Validate every spare before anything is written
+    items = batch_helper.get_batch_items()
+    valid_items, results = batch_helper.validate_items(items, validate_spare)
+
+    # Reserve all ids in one RPC, then write in as few commits as possible
+    keys = client.allocate_ids(client.key('spares'), len(valid_items)) if valid_items else []
+    new_spares = [(index, build_spare(key, content)) for (index, content), key in zip(valid_items, keys)]
+
+    # One mutation of each commit goes to the free spares counter
+    for chunk in datastore_helper.chunks(new_spares, constants.datastore_max_batch_size - 1):
+        datastore_helper.run_in_transaction(client, put_new_spares, [spare for _, spare in chunk])
+        for index, spare in chunk:
+            spare_id = datastore_helper.key_id(spare.key)
+            results[index] = batch_helper.created_result(index, spare_id,
+                                                         request.host_url + "spares/{0}".format(spare_id))
+
+    return batch_helper.batch_response(results)
+
+
+def export_spares():
+    spares_query = client.query(kind="spares")
+    cursor = pagination_helper.get_cursor()
+
+    base_url = request.host_url + "spares/"
+
+    def spare_to_dict(spare):
+        spare_id = datastore_helper.key_id(spare.key)
+        return response_helper.entity_to_dict(spare, id=spare_id, self=base_url + str(spare_id))
+
+    return export_helper.ndjson_response(spares_query, cursor, spare_to_dict)
+
+
 def get_update_and_delete_spare(spare_id):
     spare_id = int(spare_id)
 
     if request.method == 'GET':
         validate_accept_header()
 
-        spare = validate_and_get_spare(spare_id)
+        fields = fields_helper.get_fields(constants.spare_fields)
 
-        # Get car details
-        installed_car = get_installed_car_for_spare(spare)
+        spare = validate_and_get_spare(spare_id, cached=True)
 
-        spare["id"] = spare_id
-        spare["installed_car"] = installed_car
-        spare["self"] = request.base_url
+        # Get car details, unless they are not wanted
+        if fields_helper.wants(fields, "installed_car"):
+            car = get_installed_car(spare, cached=True)
+        else:
+            car = None
 
-        response = app.make_response(json.dumps(spare))
-        response.mimetype = 'application/json'
-        response.status_code = 200
-        return response
+        etag = fields_helper.fields_etag(get_spare_etag(spare, car), fields)
+        if etag_helper.is_fresh(etag):
+            return etag_helper.not_modified(etag)
+
+        installed_car = installed_car_to_dict(car)
+
+        return etag_helper.with_etag(response_helper.json_response(fields_helper.select(
+            response_helper.entity_to_dict(spare, id=spare_id, installed_car=installed_car, self=request.base_url),
+            fields)), etag)
 
     elif request.method == 'PUT':
         validate_content_type()
@@ -111,16 +150,7 @@ def get_update_and_delete_spare(spare_id):
         content = request.get_json()
         validate_spare_request_body(content)
 
-        spare.update(content)
-        client.put(spare)
-
-        spare["id"] = spare_id
-        spare["self"] = request.base_url
-
-        response = app.make_response(json.dumps(spare))
-        response.mimetype = 'application/json'
-        response.status_code = 200
-        return response
+        return save_spare(spare, content)
 
     elif request.method == 'PATCH':
         validate_content_type()
@@ -130,109 +160,221 @@ def get_update_and_delete_spare(spare_id):
         content = request.get_json()
         validate_spare_request_body_for_patch(content)
 
-        spare.update(content)
-        client.put(spare)
-
-        spare["id"] = spare_id
-        spare["self"] = request.base_url
-
-        response = app.make_response(json.dumps(spare))
-        response.mimetype = 'application/json'
-        response.status_code = 200
-        return response
+        return save_spare(spare, content)
 
     elif request.method == 'DELETE':
         # Get spare
         spare = validate_and_get_spare(spare_id)
 
-        # Delete spare
-        client.delete(spare)
+        car = get_installed_car(spare)
+        etag = get_spare_etag(spare, car)
+        etag_helper.check_if_match(etag)
+
+        # Delete spare. An installed spare also changes its car's version.
+        error = datastore_helper.run_in_transaction(client, delete_spare, spare.key,
+                                                    etag if request.if_match else None)
+        if error:
+            return error
+
+        entity_cache.invalidate(spare.key)
+        if car is not None:
+            entity_cache.invalidate(car.key)
         return "", 204
 
 
-def get_installed_car_for_spare(spare):
-    # Get car details
-    installed_car = {}
-    if "car_id" in spare and spare["car_id"] is not None:
-        car_query = client.query(kind="cars")
-        car_key = client.key("cars", spare["car_id"])
-        car_query.key_filter(car_key, "=")
-        installed_car = list(car_query.fetch())[0]
-
-        if installed_car is not None:
-            self = request.host_url + "cars/{0}".format(installed_car.key.id)
-            installed_car = {
-                "id": installed_car.key.id,
-                "name": installed_car["name"],
-                "model": installed_car["model"],
-                "self": self
-            }
-
-    return installed_car
-
-
-def validate_and_get_spare(spare_id):
-    spare_key = client.key('spares', int(spare_id))
-    spare = client.get(key=spare_key)
+def apply_spare_filters(query):
+    # Filter and sort GET /spares by indexed properties. Datastore allows
+    # inequality filters on one property per query and sorts by that property
+    # first, so a price range and a name prefix can't be combined. Returns
+    # whether anything was applied.
+    inequality = None
+
+    min_price = pagination_helper.parse_float_arg("min_price")
+    max_price = pagination_helper.parse_float_arg("max_price")
+    if min_price is not None:
+        query.add_filter("price", ">=", min_price)
+        inequality = "price"
+    if max_price is not None:
+        query.add_filter("price", "<=", max_price)
+        inequality = "price"
+
+    prefix = request.args.get("name")
+    if prefix is not None:
+        if not prefix:
+            raise AuthError({"Error": constants.invalid_query_param_error.format("name")}, 400)
+        if inequality is not None:
+            price_arg = "min_price" if min_price is not None else "max_price"
+            raise AuthError({"Error": constants.filter_conflict_error.format(price_arg, "name")}, 400)
+        # Every name starting with the prefix sorts between these two
+        query.add_filter("name", ">=", prefix)
+        query.add_filter("name", "<", prefix + "\U0010ffff")
+        inequality = "name"
+
+    installed = request.args.get("installed")
+    if installed is not None:
+        if installed not in ("true", "false"):
+            raise AuthError({"Error": constants.invalid_query_param_error.format("installed")}, 400)
+        query.add_filter("installed", "=", installed == "true")
+
+    sort = request.args.get("sort")
+    if sort is not None:
+        if sort not in constants.spare_sort_orders:
+            raise AuthError({"Error": constants.invalid_query_param_error.format("sort")}, 400)
+        if inequality is not None and sort.lstrip("-") != inequality:
+            raise AuthError({"Error": constants.sort_conflict_error.format(inequality)}, 400)
+        query.order = [sort]
+    elif inequality is not None:
+        query.order = [inequality]
+
+    return inequality is not None or installed is not None or sort is not None
+
+
+def build_spare(key, content):
+    spare = datastore.Entity(key=key)
+    spare.update({
+        "name": content["name"],
+        "price": content["price"],
+        "manu_date": str(datetime.datetime.now()),
+        "serial_num": content["serial_num"]
+    })
+    datastore_helper.set_installed_car(spare, None)
+    datastore_helper.bump_version(spare)
+    return spare
+
+
+def save_spare(spare, content):
+    # Apply a PUT or PATCH body and write the spare. The body is applied to the
+    # spare read in the write's transaction, so the new version always follows
+    # the one it replaces and the counters move from the stored price.
+    spare_id = datastore_helper.key_id(spare.key)
+
+    # The installed car is part of the ETag, so only look it up when needed
+    car = get_installed_car(spare) if request.if_match else None
+    expected_etag = get_spare_etag(spare, car)
+    etag_helper.check_if_match(expected_etag)
+
+    error = datastore_helper.run_in_transaction(client, put_spare_update, spare, content,
+                                                expected_etag if request.if_match else None)
+    entity_cache.invalidate(spare.key)
+    if error:
+        return error
+
+    response = response_helper.json_response(response_helper.entity_to_dict(spare, id=spare_id, self=request.base_url))
+    # The car read before the write only names the ETag if the spare is still on it
+    if spare.get("car_id") is None or (car is not None and datastore_helper.key_id(car.key) == spare["car_id"]):
+        etag_helper.with_etag(response, get_spare_etag(spare, car))
+    return response
+
+
+def put_new_spares(spares):
+    # Runs in a transaction. Writes new spares and counts them.
+    deltas = {}
+    for spare in spares:
+        counter_helper.count_spare(deltas, spare, 1)
+    client.put_multi(spares)
+    counter_helper.apply(deltas)
+
+
+def put_spare_update(spare, content, expected_etag=None):
+    # Runs in a transaction. Returns an error response when the spare changed
+    # since expected_etag was read, or was deleted. The counters move from the
+    # stored spare to the new one. On success spare holds what was written.
+    stored_spare = client.get(spare.key)
+    if stored_spare is None:
+        return {"Error": constants.spare_not_found_error}, 404
+    if expected_etag is not None and not spare_has_etag(stored_spare, expected_etag):
+        return {"Error": constants.precondition_failed_error}, 412
+
+    deltas = counter_helper.count_spare({}, stored_spare, -1)
+    datastore_helper.update_entity(stored_spare, content)
+    client.put(stored_spare)
+    counter_helper.apply(counter_helper.count_spare(deltas, stored_spare, 1))
+    spare.clear()
+    spare.update(stored_spare)
+
+
+def delete_spare(spare_key, expected_etag=None):
+    # Runs in a transaction. The car the spare is installed on gets a new
+    # version since its list of spares changes.
+    spare = client.get(spare_key)
     if spare is None:
-        raise AuthError({"Error": constants.spare_not_found_error}, 404)
+        return {"Error": constants.spare_not_found_error}, 404
 
-    return spare
+    car = get_installed_car(spare)
+    if expected_etag is not None and get_spare_etag(spare, car) != expected_etag:
+        return {"Error": constants.precondition_failed_error}, 412
 
+    if car is not None:
+        datastore_helper.bump_version(car)
+        client.put(car)
+    client.delete(spare_key)
+    counter_helper.apply(counter_helper.count_spare({}, spare, -1))
 
-def validate_spare_request_body(content):
-    # Check if all attributes are present
-    if ("name" not in content) or ("price" not in content) or ("serial_num" not in content):
-        raise AuthError({"Error": constants.missing_attributes_error}, 400)
 
-    validate_name(content)
-    validate_price(content)
-    validate_serial_num(content)
+def get_spare_etag(spare, car=None):
+    # A spare's body includes its installed car, so the car's version is part
+    # of the ETag
+    parts = ["spare", datastore_helper.key_id(spare.key), spare.get("version", 0)]
+    if car is not None:
+        parts += ["car", car.get("version", 0)]
+    return etag_helper.make_etag(*parts)
 
 
-def validate_spare_request_body_for_patch(content):
-    # Check if all attributes are not present
-    if {"name", "price", "serial_num"} <= content.keys():
-        raise AuthError({"Error": constants.all_attributes_error}, 400)
+def spare_has_etag(spare, etag):
+    return spare is not None and get_spare_etag(spare, get_installed_car(spare)) == etag
 
-    validate_name(content)
-    validate_price(content)
-    validate_serial_num(content)
 
+def get_installed_car(spare, cached=False):
+    # Get the car the spare is installed on, if any
+    if spare.get("car_id") is None:
+        return None
+    car_key = client.key("cars", spare["car_id"])
+    return entity_cache.get(car_key) if cached else client.get(car_key)
 
-def validate_content_type():
-    # Check if the content type header has the supported type
-    content_type = request.headers.get('Content-Type')
-    if content_type != 'application/json':
-        raise AuthError({"Error": constants.content_type_error}, 415)
 
+def installed_car_to_dict(car):
+    # Get car details
+    if car is None:
+        return {}
 
-def validate_accept_header():
-    accept = request.headers.get('Accept')
-    if accept != "application/json":
-        raise AuthError({
-            "Error": "Accept header {0} is not supported. Valid accept header is: application/json"
-            .format(accept)
-        }, 406)
+    car_id = datastore_helper.key_id(car.key)
+    return {
+        "id": car_id,
+        "name": car["name"],
+        "model": car["model"],
+        "self": request.host_url + "cars/{0}".format(car_id)
+    }
 
 
-def validate_name(content):
-    # Check if the name attribute is a string
-    if "name" in content and not isinstance(content["name"], str):
-        raise AuthError({"Error": constants.name_attribute_error}, 400)
+def validate_and_get_spare(spare_id, cached=False):
+    # Only reads may come from the cache. Writes start from the stored spare.
+    spare_key = client.key('spares', int(spare_id))
+    if cached:
+        spare = entity_cache.get(spare_key)
+    else:
+        spare = client.get(key=spare_key)
+    if spare is None:
+        raise AuthError({"Error": constants.spare_not_found_error}, 404)
+
+    return spare
 
-    # Check if the name attribute has more than 100 characters
-    if "name" in content and len(content["name"]) > constants.attribute_max_length:
-        raise AuthError({"Error": constants.attribute_length_error.format("name")}, 400)
 
+# Request body rules for spares, compiled once into single-pass validators
+spare_schema = {
+    "name": validation_helper.Field(str, constants.name_attribute_error,
+                                    constants.attribute_max_length, constants.attribute_length_error.format("name")),
+    "price": validation_helper.Field(float, constants.invalid_attribute_error.format("price")),
+    "serial_num": validation_helper.Field(int, constants.invalid_attribute_error.format("serial_num")),
+}
+spare_server_attributes = ("id", "car_id", "installed", "manu_date", "version", "self")
+validate_spare = validation_helper.compile_schema(spare_schema, immutable=spare_server_attributes)
+validate_spare_patch = validation_helper.compile_schema(spare_schema, partial=True,
+                                                        immutable=spare_server_attributes)
 
-def validate_price(content):
-    # Check if the price attribute is a float
-    if "price" in content and not isinstance(content["price"], float):
-        raise AuthError({"Error": constants.invalid_attribute_error.format("price")}, 400)
 
+def validate_spare_request_body(content):
+    validation_helper.check(validate_spare, content)
 
-def validate_serial_num(content):
-    # Check if the serial_num attribute is a string
-    if "serial_num" in content and not isinstance(content["serial_num"], int):
-        raise AuthError({"Error": constants.invalid_attribute_error.format("serial_num")}, 400)
+
+def validate_spare_request_body_for_patch(content):
+    validation_helper.check(validate_spare_patch, content)
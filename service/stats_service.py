@@ -0,0 +1,32 @@
+from flask import request
+
+from auth.auth_helper import verify_jwt
+from service import counter_helper, response_helper
+from service.validation_helper import validate_accept_header
+
+# Aggregates read from the sharded counters, a single lookup each instead of
+# paging through /cars or /spares
+
+
+def get_car_stats():
+    validate_accept_header()
+
+    payload = verify_jwt(request)
+    user_id = payload["sub"]
+
+    name = counter_helper.car_counter(user_id)
+    counters = counter_helper.read(name)
+    return response_helper.json_response({"user_id": user_id, "cars": counters[name]["count"]})
+
+
+def get_spare_stats():
+    validate_accept_header()
+
+    counters = counter_helper.read(counter_helper.INSTALLED_SPARES, counter_helper.FREE_SPARES)
+    installed = counters[counter_helper.INSTALLED_SPARES]
+    free = counters[counter_helper.FREE_SPARES]
+    return response_helper.json_response({
+        "installed": installed,
+        "free": free,
+        "total": {"count": installed["count"] + free["count"], "value": installed["value"] + free["value"]}
+    })
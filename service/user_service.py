@@ -1,52 +1,57 @@
-import json
-
-from flask import current_app as app, request
+from flask import request
 from google.cloud import datastore
 
-from auth.auth_helper import decode_auth_token, AuthError
+from cache.lru_cache import LruCache
+from constants import constants
+from service import datastore_helper, export_helper, pagination_helper, response_helper
+from storage.backend import client
 
-client = datastore.Client()
+# Subjects that are known to have a user entity, so repeat logins skip Datastore
+known_users = LruCache(constants.KNOWN_USER_CACHE_SIZE)
 
 
 def get_all_users():
+    # Only the key and sub are read
     users_query = client.query(kind="users")
-    all_users = list(users_query.fetch())
-    user_response = []
+    users_query.projection = ["sub"]
 
-    for user in all_users:
-        user_response.append({
-            "id": user.key.id,
-            "sub": user["sub"]
-        })
+    # ?stream=true sends every user as NDJSON, one batch in memory at a time
+    if request.args.get("stream", "false").lower() == "true":
+        return export_helper.ndjson_response(users_query, pagination_helper.get_cursor(), user_to_dict)
+
+    limit, cursor, offset = pagination_helper.get_page_params(constants.users_page_default_limit)
+    all_users, next_cursor = pagination_helper.fetch_page(users_query, limit, cursor, offset)
+
+    response = response_helper.json_response([user_to_dict(user) for user in all_users])
 
-    response = app.make_response(json.dumps(user_response))
-    response.mimetype = 'application/json'
-    response.status_code = 200
+    # The body stays a plain list, so the next page is linked from a header
+    if next_cursor:
+        response.headers["Link"] = '<{0}>; rel="next"'.format(pagination_helper.next_page_url(limit, next_cursor))
     return response
 
 
-def create_user(auth_token):
-    payload = decode_auth_token(auth_token)
-    user_id = payload["sub"]
+def user_to_dict(user):
+    return {
+        "id": datastore_helper.key_id(user.key),
+        "sub": user["sub"]
+    }
 
-    users_query = client.query(kind="users")
-    users_query.add_filter("sub", "=", user_id)
-    all_users = list(users_query.fetch())
 
-    if len(all_users) == 0:
-        new_user = datastore.Entity(key=client.key('users'))
-        new_user.update({
-            "sub": user_id
-        })
-        client.put(new_user)
+def create_user(user_id):
+    # Users are keyed by sub, so the upsert is a get-or-insert by key
+    if known_users.get(user_id) is None:
+        datastore_helper.run_in_transaction(client, get_or_insert_user, user_id)
+        known_users.set(user_id, True)
 
     return user_id
 
 
-def validate_accept_header():
-    accept = request.headers.get('Accept')
-    if accept != "application/json":
-        raise AuthError({
-            "Error": "Accept header {0} is not supported. Valid accept header is: application/json"
-            .format(accept)
-        }, 406)
+def get_or_insert_user(user_id):
+    # Runs in a transaction
+    user_key = client.key('users', user_id)
+    if client.get(user_key) is None:
+        new_user = datastore.Entity(key=user_key)
+        new_user.update({
+            "sub": user_id
+        })
+        client.put(new_user)
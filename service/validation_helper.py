@@ -0,0 +1,93 @@
+from flask import request
+
+from auth.auth_helper import AuthError
+from constants import constants
+
+MISSING = object()
+
+
+class Field:
+    # Rules for one attribute of a request body
+    def __init__(self, types, type_error, max_length=None, length_error=None):
+        self.types = types
+        self.type_error = type_error
+        self.max_length = max_length
+        self.length_error = length_error
+
+
+def compile_schema(fields, partial=False, immutable=("id",)):
+    """
+    Compile a resource's fields into a validator that checks a request body in
+    a single pass and returns every error message, or an empty list.
+
+    A full body (POST, PUT) must have every field. A partial body (PATCH) may
+    have any of them but not all. No body may have attributes outside the
+    schema: the immutable ones are owned by the server, and the rest would be
+    written to the entity unchecked.
+    """
+    checks = []
+    for name, field in fields.items():
+        # bool is an int, but never a valid number here
+        reject_bool = bool not in (field.types if isinstance(field.types, tuple) else (field.types,))
+        checks.append((name, field.types, reject_bool, field.type_error, field.max_length, field.length_error))
+    checks = tuple(checks)
+    field_count = len(checks)
+
+    def validate(content):
+        if not isinstance(content, dict):
+            return [constants.body_type_error]
+
+        errors = []
+        present = 0
+        for name, types, reject_bool, type_error, max_length, length_error in checks:
+            value = content.get(name, MISSING)
+            if value is MISSING:
+                continue
+
+            present += 1
+            if not isinstance(value, types) or (reject_bool and type(value) is bool):
+                errors.append(type_error)
+            elif max_length is not None and len(value) > max_length:
+                errors.append(length_error)
+
+        if not partial:
+            if present < field_count:
+                errors.insert(0, constants.missing_attributes_error)
+        elif present == field_count:
+            errors.insert(0, constants.all_attributes_error)
+
+        if len(content) > present:
+            extra = []
+            for name in content:
+                if name not in fields:
+                    error = constants.immutable_attribute_error if name in immutable \
+                        else constants.unknown_attribute_error
+                    extra.append(error.format(name))
+            errors[:0] = extra
+        return errors
+
+    return validate
+
+
+def check(validate, content):
+    # Raise every error of the body at once. "Error" keeps the first one for
+    # clients that only read a single message.
+    errors = validate(content)
+    if errors:
+        raise AuthError({"Error": errors[0], "Errors": errors}, 400)
+
+
+def validate_content_type():
+    # Check if the content type header has the supported type
+    content_type = request.headers.get('Content-Type')
+    if content_type != 'application/json':
+        raise AuthError({"Error": constants.content_type_error}, 415)
+
+
+def validate_accept_header():
+    accept = request.headers.get('Accept')
+    if accept != "application/json":
+        raise AuthError({
+            "Error": "Accept header {0} is not supported. Valid accept header is: application/json"
+            .format(accept)
+        }, 406)
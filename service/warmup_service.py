@@ -0,0 +1,22 @@
+import logging
+
+from auth.auth_helper import jwks_store
+from storage.backend import client
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    # Called by App Engine before a new instance gets traffic. The lookup
+    # creates the shared Datastore client and opens its channel, and the JWKS
+    # refresh loads the signing keys, so the first user request pays for
+    # neither. A failure is only logged, the instance still serves requests.
+    try:
+        client.get(client.key("warmup", "warmup"))
+    except Exception:
+        logger.warning("Datastore warmup failed", exc_info=True)
+    try:
+        jwks_store.refresh()
+    except Exception:
+        logger.warning("JWKS warmup failed", exc_info=True)
+    return "", 200
@@ -0,0 +1,32 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncClient:
+    """
+    Awaitable front for a blocking storage client. Calls run on a shared thread
+    pool, so a coroutine can have several Datastore RPCs in flight at once with
+    asyncio.gather.
+
+    Each call runs in a copy of the caller's context, which keeps Flask's request
+    context and the request's timing spans available in the worker thread.
+    Transactions are bound to the thread that opened them, so only calls outside
+    a transaction should go through here.
+    """
+
+    def __init__(self, client, max_workers):
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="datastore")
+
+    async def run(self, func, *args):
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(context.run, func, *args))
+
+    async def get(self, key):
+        return await self.run(self.client.get, key)
+
+    async def get_multi(self, keys):
+        return await self.run(self.client.get_multi, keys)
@@ -0,0 +1,71 @@
+import threading
+
+from cache.entity_cache import EntityCache, LocalSharedCache
+from cache.lru_cache import LruCache
+from constants import constants
+from storage.async_client import AsyncClient
+from storage.instrumented_client import InstrumentedClient
+
+_client = None
+_lock = threading.Lock()
+
+
+def create_client(backend):
+    # Build a client for the configured storage backend. All backends share the
+    # google.cloud.datastore.Client API used by the services.
+    if backend == "datastore":
+        from google.cloud import datastore
+        return datastore.Client()
+    elif backend == "memory":
+        from storage.memory_backend import MemoryClient
+        return MemoryClient()
+    elif backend == "sqlite":
+        from storage.sqlite_backend import SqliteClient
+        return SqliteClient(constants.SQLITE_PATH)
+    raise ValueError("Unknown storage backend: {0}".format(backend))
+
+
+def get_client():
+    # One client per process, created on first use
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = InstrumentedClient(create_client(constants.STORAGE_BACKEND))
+    return _client
+
+
+def set_client(client):
+    # Replace the shared client, e.g. with a MemoryClient in benchmarks
+    global _client
+    _client = InstrumentedClient(client)
+    entity_cache.clear()
+
+
+class LazyClient:
+    # Stands in for the shared client at import time and forwards every
+    # attribute to it, so modules can keep a module-level `client`.
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+
+client = LazyClient()
+
+
+def create_entity_cache():
+    # The shared tier is "none", or "local" for an in-process stand-in with the
+    # interface of a Memorystore client
+    shared = None
+    if constants.ENTITY_CACHE_SHARED == "local":
+        shared = LocalSharedCache(constants.ENTITY_CACHE_SIZE)
+    elif constants.ENTITY_CACHE_SHARED != "none":
+        raise ValueError("Unknown entity cache tier: {0}".format(constants.ENTITY_CACHE_SHARED))
+    return EntityCache(client, LruCache(constants.ENTITY_CACHE_SIZE, ttl=constants.ENTITY_CACHE_TTL), shared,
+                       ttl=constants.ENTITY_CACHE_TTL)
+
+
+# Cars and spares read by GET requests
+entity_cache = create_entity_cache()
+
+# Thread pool backed client for the async request path
+async_client = AsyncClient(client, constants.ASYNC_MAX_WORKERS)
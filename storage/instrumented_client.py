@@ -0,0 +1,122 @@
+import time
+from contextlib import nullcontext
+
+from monitoring.timing import record, span
+
+
+class InstrumentedClient:
+    """
+    Wraps a storage client so every Datastore RPC is timed as a
+    "datastore.<rpc>" span of the current request. Everything else is forwarded
+    to the wrapped client untouched.
+    """
+
+    def __init__(self, client):
+        self.wrapped = client
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def get(self, key, **kwargs):
+        with span("datastore.lookup"):
+            return self.wrapped.get(key, **kwargs)
+
+    def get_multi(self, keys, **kwargs):
+        if not keys:
+            return self.wrapped.get_multi(keys, **kwargs)
+        with span("datastore.lookup"):
+            return self.wrapped.get_multi(keys, **kwargs)
+
+    def put(self, entity, **kwargs):
+        with self._mutation():
+            return self.wrapped.put(entity, **kwargs)
+
+    def put_multi(self, entities, **kwargs):
+        with self._mutation():
+            return self.wrapped.put_multi(entities, **kwargs)
+
+    def delete(self, key, **kwargs):
+        with self._mutation():
+            return self.wrapped.delete(key, **kwargs)
+
+    def delete_multi(self, keys, **kwargs):
+        with self._mutation():
+            return self.wrapped.delete_multi(keys, **kwargs)
+
+    def allocate_ids(self, incomplete_key, num_ids, **kwargs):
+        with span("datastore.allocate_ids"):
+            return self.wrapped.allocate_ids(incomplete_key, num_ids, **kwargs)
+
+    def transaction(self, **kwargs):
+        return InstrumentedTransaction(self.wrapped.transaction(**kwargs), kwargs.get("begin_later", False))
+
+    def query(self, **kwargs):
+        return InstrumentedQuery(self.wrapped.query(**kwargs))
+
+    def _mutation(self):
+        # Inside a transaction mutations are buffered until the commit
+        if self.wrapped.current_transaction is not None:
+            return nullcontext()
+        return span("datastore.commit")
+
+
+class InstrumentedTransaction:
+    def __init__(self, transaction, begin_later):
+        self.wrapped = transaction
+        self.begin_later = begin_later
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def __enter__(self):
+        if self.begin_later:
+            self.wrapped.__enter__()
+        else:
+            with span("datastore.begin_transaction"):
+                self.wrapped.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with span("datastore.commit" if exc_type is None else "datastore.rollback"):
+            return self.wrapped.__exit__(exc_type, exc_value, traceback)
+
+
+class InstrumentedQuery:
+    def __init__(self, query):
+        object.__setattr__(self, "wrapped", query)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def __setattr__(self, name, value):
+        # Query options like projection and order are set as attributes
+        setattr(self.wrapped, name, value)
+
+    def fetch(self, *args, **kwargs):
+        return InstrumentedIterator(self.wrapped.fetch(*args, **kwargs))
+
+
+class InstrumentedIterator:
+    def __init__(self, iterator):
+        self.wrapped = iterator
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    @property
+    def pages(self):
+        # Each page is one RunQuery RPC
+        pages = self.wrapped.pages
+        while True:
+            start = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                return
+            record("datastore.run_query", time.perf_counter() - start)
+            yield page
+
+    def __iter__(self):
+        for page in self.pages:
+            for entity in page:
+                yield entity
+
@@ -0,0 +1,381 @@
+import base64
+import itertools
+import threading
+import time
+from collections import Counter
+
+from google.api_core import exceptions
+from google.cloud import datastore
+
+
+class MemoryClient:
+    """
+    In-process storage backend with the google.cloud.datastore.Client API.
+
+    Implements the part of the client API the services use, with real Key and
+    Entity objects, so the request path runs unchanged without a network. Every
+    call that would be a Datastore RPC is counted in rpc_counts and can be
+    slowed down by rpc_latency seconds to model the round trip in benchmarks.
+
+    Subclasses store entities elsewhere by overriding read_entity, write_entity,
+    scan and next_id.
+    """
+
+    def __init__(self, project="local", namespace=None, rpc_latency=0.0):
+        self.project = project
+        self.namespace = namespace
+        self.rpc_latency = rpc_latency
+        self.rpc_counts = Counter()
+
+        self._entities = {}  # kind -> {key: entity}
+        self._versions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    # Keys and transactions
+
+    def key(self, *path_args, **kwargs):
+        kwargs.setdefault("project", self.project)
+        kwargs.setdefault("namespace", self.namespace)
+        return datastore.Key(*path_args, **kwargs)
+
+    def allocate_ids(self, incomplete_key, num_ids, retry=None, timeout=None):
+        self._rpc("allocate_ids")
+        with self._lock:
+            return [incomplete_key.completed_key(self.next_id()) for _ in range(num_ids)]
+
+    def transaction(self, begin_later=False, **kwargs):
+        return MemoryTransaction(self, begin_later=begin_later)
+
+    @property
+    def current_transaction(self):
+        return getattr(self._local, "transaction", None)
+
+    # Reads
+
+    def get(self, key, missing=None, deferred=None, transaction=None, eventual=False, retry=None, timeout=None,
+            read_time=None):
+        entities = self.get_multi([key], missing=missing, transaction=transaction)
+        return entities[0] if entities else None
+
+    def get_multi(self, keys, missing=None, deferred=None, transaction=None, eventual=False, retry=None,
+                  timeout=None, read_time=None):
+        if not keys:
+            return []
+        self._rpc("lookup")
+        transaction = transaction or self.current_transaction
+
+        found = []
+        with self._lock:
+            if transaction is not None:
+                # A begin_later transaction begins with its first lookup
+                transaction.begun = True
+            for key in keys:
+                entity, version = self.read_entity(key)
+                if transaction is not None:
+                    transaction.record_read(key, version)
+                if entity is None:
+                    if missing is not None:
+                        missing.append(datastore.Entity(key=key))
+                else:
+                    found.append(copy_entity(entity))
+        return found
+
+    def query(self, **kwargs):
+        return MemoryQuery(self, **kwargs)
+
+    # Writes
+
+    def put(self, entity, retry=None, timeout=None):
+        self.put_multi([entity])
+
+    def put_multi(self, entities, retry=None, timeout=None):
+        if not entities:
+            return
+        for entity in entities:
+            if entity.key is None:
+                raise ValueError("Entity must have a key")
+            if entity.key.is_partial:
+                with self._lock:
+                    entity.key = entity.key.completed_key(self.next_id())
+
+        mutations = [("put", entity.key, copy_entity(entity)) for entity in entities]
+        if self.current_transaction is not None:
+            self.current_transaction.mutations.extend(mutations)
+        else:
+            self._rpc("commit")
+            self.apply(mutations)
+
+    def delete(self, key, retry=None, timeout=None):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys, retry=None, timeout=None):
+        if not keys:
+            return
+        mutations = [("delete", key, None) for key in keys]
+        if self.current_transaction is not None:
+            self.current_transaction.mutations.extend(mutations)
+        else:
+            self._rpc("commit")
+            self.apply(mutations)
+
+    # Hooks shared with MemoryTransaction and MemoryQuery
+
+    def apply(self, mutations, read_versions=None):
+        with self._lock:
+            for key, version in (read_versions or {}).items():
+                if self.read_entity(key)[1] != version:
+                    raise exceptions.Aborted("Transaction lock timeout or contention on {0}".format(key))
+
+            for operation, key, entity in mutations:
+                self.write_entity(key, entity if operation == "put" else None)
+
+    # Storage. Entities are stored and returned as private copies.
+
+    def read_entity(self, key):
+        # Returns the stored entity (or None) and its write version
+        return self._entities.get(key.kind, {}).get(key), self._versions.get(key, 0)
+
+    def write_entity(self, key, entity):
+        # Stores the entity, or deletes it when entity is None
+        self._versions[key] = self._versions.get(key, 0) + 1
+        if entity is None:
+            self._entities.get(key.kind, {}).pop(key, None)
+        else:
+            self._entities.setdefault(key.kind, {})[key] = entity
+
+    def scan(self, kind, filters=()):
+        # Returns every entity of the kind. Filters are only a hint, the query
+        # applies them again.
+        with self._lock:
+            return list(self._entities.get(kind, {}).values())
+
+    def next_id(self):
+        return next(self._ids)
+
+    def _rpc(self, name):
+        self.rpc_counts[name] += 1
+        if self.rpc_latency:
+            time.sleep(self.rpc_latency)
+
+
+class MemoryTransaction:
+    def __init__(self, client, begin_later=False):
+        self.client = client
+        self.begin_later = begin_later
+        self.begun = False
+        self.mutations = []
+        self.read_versions = {}
+
+    def record_read(self, key, version):
+        self.read_versions.setdefault(key, version)
+
+    def __enter__(self):
+        if self.client.current_transaction is not None:
+            raise ValueError("Cannot begin a transaction inside another transaction")
+        if not self.begin_later:
+            self.begin()
+        self.client._local.transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.client._local.transaction = None
+        if exc_type is not None:
+            if self.begun:
+                self.client._rpc("rollback")
+            return False
+        if not self.begun:
+            # Nothing was read and nothing was written
+            if not self.mutations:
+                return False
+            self.begin()
+        self.client._rpc("commit")
+        self.client.apply(self.mutations, self.read_versions)
+        return False
+
+    def begin(self):
+        self.client._rpc("begin_transaction")
+        self.begun = True
+
+
+class MemoryQuery:
+    OPERATORS = {
+        "=": lambda value, arg: value == arg,
+        "!=": lambda value, arg: value != arg,
+        "<": lambda value, arg: sort_value(value) < sort_value(arg),
+        "<=": lambda value, arg: sort_value(value) <= sort_value(arg),
+        ">": lambda value, arg: sort_value(value) > sort_value(arg),
+        ">=": lambda value, arg: sort_value(value) >= sort_value(arg),
+        "IN": lambda value, arg: value in arg,
+        "NOT_IN": lambda value, arg: value not in arg,
+    }
+
+    def __init__(self, client, kind=None, projection=(), filters=(), order=(), **kwargs):
+        self.client = client
+        self.kind = kind
+        self._projection = list(projection)
+        self._filters = list(filters)
+        self._order = list(order)
+
+    @property
+    def filters(self):
+        return self._filters[:]
+
+    def add_filter(self, property_name, operator, value):
+        if operator not in self.OPERATORS:
+            raise ValueError('Invalid expression: "%s"' % (operator,))
+        self._filters.append((property_name, operator, value))
+        return self
+
+    def key_filter(self, key, operator="="):
+        return self.add_filter("__key__", operator, key)
+
+    @property
+    def projection(self):
+        return self._projection[:]
+
+    @projection.setter
+    def projection(self, projection):
+        if isinstance(projection, str):
+            projection = [projection]
+        self._projection[:] = projection
+
+    def keys_only(self):
+        self._projection[:] = ["__key__"]
+
+    @property
+    def order(self):
+        return self._order[:]
+
+    @order.setter
+    def order(self, value):
+        if isinstance(value, str):
+            value = [value]
+        self._order[:] = value
+
+    def fetch(self, limit=None, offset=0, start_cursor=None, end_cursor=None, client=None, eventual=False,
+              retry=None, timeout=None, read_time=None):
+        return MemoryIterator(self, limit=limit, offset=offset, start_cursor=start_cursor)
+
+    def run(self):
+        # Evaluate the query against a snapshot of the kind
+        results = []
+        for entity in self.client.scan(self.kind, self._filters):
+            if all(self._matches(entity, *query_filter) for query_filter in self._filters):
+                results.append(entity)
+
+        results.sort(key=lambda entity: sort_value(entity.key))
+        for order in reversed(self._order):
+            name = order.lstrip("-")
+            results.sort(key=lambda entity: sort_value(property_value(entity, name)),
+                         reverse=order.startswith("-"))
+
+        projection = [name for name in self._projection if name != "__key__"]
+        if projection:
+            results = [entity for entity in results if all(name in entity for name in projection)]
+        return results
+
+    def project(self, entity):
+        # Copy of a stored entity as the query returns it
+        if not self._projection:
+            return copy_entity(entity)
+        projected = datastore.Entity(key=entity.key)
+        for name in self._projection:
+            if name != "__key__":
+                projected[name] = entity[name]
+        return projected
+
+    def _matches(self, entity, name, operator, arg):
+        if name != "__key__" and name not in entity:
+            return False
+        return self.OPERATORS[operator](property_value(entity, name), arg)
+
+
+class MemoryIterator:
+    # Largest batch the emulated RunQuery RPC returns when no limit is set
+    BATCH_SIZE = 300
+
+    def __init__(self, query, limit=None, offset=0, start_cursor=None):
+        self.query = query
+        self.limit = limit
+        self.next_page_token = start_cursor
+        self.num_results = 0
+
+        self._position = decode_cursor(start_cursor) if start_cursor else offset or 0
+        self._results = None
+
+    @property
+    def pages(self):
+        while True:
+            page = self._next_page()
+            yield page
+            if not self._has_next_page():
+                return
+
+    def __iter__(self):
+        for page in self.pages:
+            for entity in page:
+                yield entity
+
+    def _next_page(self):
+        self.query.client._rpc("run_query")
+        if self._results is None:
+            self._results = self.query.run()
+
+        size = self.BATCH_SIZE
+        if self.limit is not None:
+            size = min(size, self.limit - self.num_results)
+        page = [self.query.project(entity) for entity in self._results[self._position:self._position + size]]
+        self._position += len(page)
+        self.num_results += len(page)
+
+        more = self._position < len(self._results)
+        self.next_page_token = encode_cursor(self._position) if more else None
+        return page
+
+    def _has_next_page(self):
+        if self.limit is not None and self.num_results >= self.limit:
+            return False
+        return self.next_page_token is not None
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(str(position).encode("ascii"))
+
+
+def decode_cursor(cursor):
+    if isinstance(cursor, str):
+        cursor = cursor.encode("ascii")
+    try:
+        return int(base64.urlsafe_b64decode(cursor).decode("ascii"))
+    except ValueError:
+        raise exceptions.BadRequest("Invalid cursor")
+
+
+def copy_entity(entity):
+    copied = datastore.Entity(key=entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+    copied.update(entity)
+    return copied
+
+
+def property_value(entity, name):
+    if name == "__key__":
+        return entity.key
+    return entity.get(name)
+
+
+def sort_value(value):
+    # Datastore orders values of different types by type first
+    if value is None:
+        return 0, 0
+    if isinstance(value, bool):
+        return 2, value
+    if isinstance(value, (int, float)):
+        return 1, value
+    if isinstance(value, str):
+        return 3, value
+    if isinstance(value, datastore.Key):
+        return 4, tuple((kind, (0, id_or_name) if isinstance(id_or_name, int) else (1, str(id_or_name)))
+                        for kind, id_or_name in zip(value.flat_path[::2], value.flat_path[1::2]))
+    return 5, str(value)
@@ -0,0 +1,126 @@
+import json
+import sqlite3
+
+from google.api_core import exceptions
+from google.cloud import datastore
+
+from storage.memory_backend import MemoryClient
+
+
+class SqliteClient(MemoryClient):
+    """
+    Storage backend that keeps entities in a single SQLite file.
+
+    Uses the same client API, transactions and query engine as MemoryClient.
+    Entities are stored as JSON, one row per key, and equality filters are pushed
+    down to SQLite so queries only decode the rows that can match. Ids come from
+    a counter row in the file, so processes sharing the file never hand out the
+    same id. A write waits up to timeout seconds for another process to release
+    the file's write lock, then fails like a Datastore commit that lost to a
+    concurrent transaction.
+    """
+
+    def __init__(self, path, project="local", namespace=None, rpc_latency=0.0, timeout=5.0):
+        super().__init__(project=project, namespace=namespace, rpc_latency=rpc_latency)
+        self.path = path
+
+        self._connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entities ("
+            "path TEXT PRIMARY KEY, kind TEXT NOT NULL, key_id INTEGER, "
+            "version INTEGER NOT NULL, properties TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entities_kind ON entities (kind)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS id_sequence (last_id INTEGER NOT NULL)")
+        # A file from before the counter existed starts after its largest id
+        self._connection.execute(
+            "INSERT INTO id_sequence (last_id) SELECT COALESCE(MAX(key_id), 0) FROM entities "
+            "WHERE NOT EXISTS (SELECT 1 FROM id_sequence)")
+
+    def read_entity(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT version, properties FROM entities WHERE path = ?", (encode_path(key),)).fetchone()
+        if row is None:
+            return None, 0
+        version, properties = row
+        if properties is None:
+            return None, version
+        return self._decode(key, properties), version
+
+    def write_entity(self, key, entity):
+        with self._lock:
+            properties = json.dumps(dict(entity)) if entity is not None else None
+            self._connection.execute(
+                "INSERT INTO entities (path, kind, key_id, version, properties) VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT (path) DO UPDATE SET version = version + 1, properties = excluded.properties",
+                (encode_path(key), key.kind, key.id, properties))
+
+    def apply(self, mutations, read_versions=None):
+        # Commit all mutations of a transaction in one SQLite transaction. The
+        # write lock is taken before the read versions are checked, so another
+        # process can't commit in between.
+        with self._lock:
+            self._begin()
+            try:
+                super().apply(mutations, read_versions)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def scan(self, kind, filters=()):
+        sql = "SELECT path, properties FROM entities WHERE kind = ? AND properties IS NOT NULL"
+        params = [kind]
+        for name, operator, value in filters:
+            if operator == "=" and name != "__key__" and isinstance(value, (str, int, float)):
+                sql += " AND json_extract(properties, ?) = ?"
+                params.extend(['$."{0}"'.format(name), value])
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [self._decode(self.key(*json.loads(path)), properties) for path, properties in rows]
+
+    def allocate_ids(self, incomplete_key, num_ids, retry=None, timeout=None):
+        # One write transaction for the whole range
+        self._rpc("allocate_ids")
+        first_id = self.reserve_ids(num_ids)
+        return [incomplete_key.completed_key(first_id + i) for i in range(num_ids)]
+
+    def next_id(self):
+        return self.reserve_ids(1)
+
+    def reserve_ids(self, count):
+        # Returns the first of count new ids. The file's write lock is taken
+        # first, so the read and the update can't interleave with another
+        # process doing the same.
+        with self._lock:
+            self._begin()
+            try:
+                last_id = self._connection.execute("SELECT last_id FROM id_sequence").fetchone()[0]
+                self._connection.execute("UPDATE id_sequence SET last_id = ?", (last_id + count,))
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+        return last_id + 1
+
+    def _begin(self):
+        # BEGIN IMMEDIATE takes the write lock up front rather than at the first
+        # write, when SQLite can no longer wait for it. A lock still held after
+        # the timeout raises Aborted, which run_in_transaction retries.
+        try:
+            self._connection.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as error:
+            if "locked" in str(error) or "busy" in str(error):
+                raise exceptions.Aborted("SQLite database {0} is locked".format(self.path)) from error
+            raise
+
+    def _decode(self, key, properties):
+        entity = datastore.Entity(key=key)
+        entity.update(json.loads(properties))
+        return entity
+
+
+def encode_path(key):
+    return json.dumps(key.flat_path)
@@ -0,0 +1,28 @@
+from unittest import mock
+
+import pytest
+
+from storage import backend
+from storage.memory_backend import MemoryClient
+
+USER_ID = "test-user"
+JSON_HEADERS = {"Authorization": "Bearer test", "Accept": "application/json", "Content-Type": "application/json"}
+
+
+@pytest.fixture
+def client():
+    # A fresh in-memory storage backend for every test
+    client = MemoryClient()
+    backend.set_client(client)
+    return client
+
+
+@pytest.fixture
+def test_client(client):
+    from main import app
+    from service import async_car_service, car_service, stats_service
+
+    with mock.patch.object(car_service, "verify_jwt", return_value={"sub": USER_ID}), \
+            mock.patch.object(async_car_service, "verify_jwt", return_value={"sub": USER_ID}), \
+            mock.patch.object(stats_service, "verify_jwt", return_value={"sub": USER_ID}):
+        yield app.test_client()
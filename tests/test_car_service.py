@@ -0,0 +1,233 @@
+from unittest import mock
+
+from google.api_core import exceptions
+from google.cloud import datastore
+
+from conftest import JSON_HEADERS
+from service import datastore_helper
+
+
+def create_car(test_client, name):
+    response = test_client.post("/cars", json={"name": name, "model": "model", "reg_num": "KA01", "color": "red"},
+                                headers=JSON_HEADERS)
+    assert response.status_code == 201
+    return response.json["id"]
+
+
+def create_spares(test_client, count, price=10.0):
+    response = test_client.post("/spares/batch", json=[{"name": "spare", "price": price, "serial_num": 1}] * count,
+                                headers=JSON_HEADERS)
+    assert response.status_code == 201
+    return [result["id"] for result in response.json["results"]]
+
+
+def spare_stats(test_client):
+    return test_client.get("/stats/spares", headers=JSON_HEADERS).json
+
+
+def conflict_once(client):
+    # Makes the next commit lose to a concurrent transaction, once
+    apply = client.apply
+    calls = []
+
+    def apply_with_conflict(mutations, read_versions=None):
+        if read_versions is not None and not calls:
+            calls.append(mutations)
+            raise exceptions.Aborted("injected conflict")
+        return apply(mutations, read_versions)
+
+    return mock.patch.object(client, "apply", apply_with_conflict)
+
+
+def test_delete_car_retried_after_conflict_counts_spares_once(client, test_client):
+    car_id = create_car(test_client, "car")
+    spare_ids = create_spares(test_client, 4)
+    assert test_client.put("/cars/{0}/spares".format(car_id), json={"spare_ids": spare_ids},
+                           headers=JSON_HEADERS).status_code == 204
+
+    with conflict_once(client):
+        assert test_client.delete("/cars/{0}".format(car_id), headers=JSON_HEADERS).status_code == 204
+
+    stats = spare_stats(test_client)
+    assert stats["installed"] == {"count": 0, "value": 0}
+    assert stats["free"] == {"count": 4, "value": 40.0}
+    for spare_id in spare_ids:
+        spare = client.get(client.key("spares", spare_id))
+        assert spare["car_id"] is None
+        # Installed, then removed once
+        assert spare["version"] == 3
+
+
+def test_delete_car_keeps_spare_moved_to_another_car(client, test_client):
+    car_id = create_car(test_client, "car")
+    other_car_id = create_car(test_client, "other")
+    spare_id = create_spares(test_client, 1)[0]
+    assert test_client.put("/cars/{0}/spares/{1}".format(car_id, spare_id),
+                           headers=JSON_HEADERS).status_code == 204
+
+    # The spare moves to the other car after the delete queried the car's
+    # spares, before its transaction runs
+    run_in_transaction = datastore_helper.run_in_transaction
+
+    def move_spare_then_run(*args):
+        spare = client.get(client.key("spares", spare_id))
+        if spare["car_id"] == car_id:
+            spare["car_id"] = other_car_id
+            client.put(spare)
+        return run_in_transaction(*args)
+
+    with mock.patch.object(datastore_helper, "run_in_transaction", move_spare_then_run):
+        assert test_client.delete("/cars/{0}".format(car_id), headers=JSON_HEADERS).status_code == 204
+
+    assert client.get(client.key("spares", spare_id))["car_id"] == other_car_id
+
+
+def test_install_spares_fits_in_one_commit(client, test_client):
+    from constants import constants
+
+    car_id = create_car(test_client, "car")
+    spare_ids = create_spares(test_client, constants.datastore_max_batch_size - 2)
+
+    response = test_client.put("/cars/{0}/spares".format(car_id), json={"spare_ids": spare_ids},
+                               headers=JSON_HEADERS)
+    assert response.status_code == 400
+    assert response.json["Error"] == constants.spare_ids_error.format(constants.datastore_max_batch_size - 3)
+
+    commits = []
+    apply = client.apply
+
+    def record_commit(mutations, read_versions=None):
+        commits.append(len(mutations))
+        return apply(mutations, read_versions)
+
+    with mock.patch.object(client, "apply", record_commit):
+        for method in ("put", "delete"):
+            response = getattr(test_client, method)("/cars/{0}/spares".format(car_id),
+                                                    json={"spare_ids": spare_ids[1:]}, headers=JSON_HEADERS)
+            assert response.status_code == 204
+    assert commits == [constants.datastore_max_batch_size] * 2
+
+
+def test_reserved_key_names_are_valid_for_any_car_name(client, test_client):
+    for name in ("", "__car__"):
+        create_car(test_client, name)
+        response = test_client.post("/cars", json={"name": name, "model": "m", "reg_num": "r", "color": "c"},
+                                    headers=JSON_HEADERS)
+        assert response.status_code == 403
+
+    for reservation in client.query(kind="car_names").fetch():
+        key_name = reservation.key.name
+        assert key_name and not (key_name.startswith("__") and key_name.endswith("__"))
+
+
+def test_delete_releases_the_name_of_a_car_renamed_meanwhile(client, test_client):
+    from service import car_service
+
+    car_id = create_car(test_client, "old")
+
+    # A rename commits after the delete read the car, before its transaction
+    run_in_transaction = datastore_helper.run_in_transaction
+
+    def rename_then_run(*args):
+        car = client.get(client.key("cars", car_id))
+        if car["name"] == "old":
+            car["name"] = "new"
+            client.put_multi([car, datastore.Entity(key=car_service.get_name_reservation_key("new"))])
+            client.delete(car_service.get_name_reservation_key("old"))
+        return run_in_transaction(*args)
+
+    with mock.patch.object(datastore_helper, "run_in_transaction", rename_then_run):
+        assert test_client.delete("/cars/{0}".format(car_id), headers=JSON_HEADERS).status_code == 204
+
+    assert list(client.query(kind="car_names").fetch()) == []
+    create_car(test_client, "new")
+
+
+def test_patch_rejects_server_owned_attributes(client, test_client):
+    car_id = create_car(test_client, "car")
+
+    response = test_client.patch("/cars/{0}".format(car_id), json={"color": 1, "user_id": "other-user"},
+                                 headers=JSON_HEADERS)
+    assert response.status_code == 400
+    assert response.json["Errors"] == ["The attribute 'user_id' cannot be updated",
+                                       "The attribute 'color' is not valid"]
+    assert client.get(client.key("cars", car_id))["user_id"] == "test-user"
+
+    response = test_client.patch("/cars/{0}".format(car_id), json={"color": "blue", "owner": "other-user"},
+                                 headers=JSON_HEADERS)
+    assert response.status_code == 400
+    assert response.json["Errors"] == ["The attribute 'owner' is not supported"]
+
+
+def test_spare_body_cannot_move_a_spare_between_cars(client, test_client):
+    car_id = create_car(test_client, "car")
+    spare_id = create_spares(test_client, 1)[0]
+
+    for body in ({"car_id": car_id}, {"installed": True}):
+        response = test_client.patch("/spares/{0}".format(spare_id), json=body, headers=JSON_HEADERS)
+        assert response.status_code == 400
+
+    assert client.get(client.key("spares", spare_id))["car_id"] is None
+    stats = spare_stats(test_client)
+    assert stats["installed"] == {"count": 0, "value": 0}
+    assert stats["free"] == {"count": 1, "value": 10.0}
+
+
+def test_patch_after_a_concurrent_write_gets_a_new_version(client, test_client):
+    car_id = create_car(test_client, "car")
+    spare_id = create_spares(test_client, 1)[0]
+
+    # Another request writes the entity after the PATCH read it, before its
+    # transaction runs
+    run_in_transaction = datastore_helper.run_in_transaction
+    writes = []
+
+    def write_then_run(*args):
+        if not writes:
+            writes.append(None)
+            writes[0] = test_client.patch(url, json=concurrent, headers=JSON_HEADERS).headers["ETag"]
+        return run_in_transaction(*args)
+
+    for url, concurrent, body in (("/cars/{0}".format(car_id), {"color": "blue"}, {"model": "other"}),
+                                  ("/spares/{0}".format(spare_id), {"price": 20.0}, {"name": "other"})):
+        del writes[:]
+        with mock.patch.object(datastore_helper, "run_in_transaction", write_then_run):
+            response = test_client.patch(url, json=body, headers=JSON_HEADERS)
+        assert response.status_code == 200
+        assert response.headers["ETag"] != writes[0]
+        # Both writes are kept
+        assert response.json[next(iter(concurrent))] == next(iter(concurrent.values()))
+
+    stats = spare_stats(test_client)
+    assert stats["free"] == {"count": 1, "value": 20.0}
+
+
+def test_conditional_delete_of_a_changed_car_detaches_no_spares(client, test_client):
+    from constants import constants
+
+    car_id = create_car(test_client, "car")
+    spare_ids = create_spares(test_client, constants.datastore_max_batch_size)
+    for batch in (spare_ids[:250], spare_ids[250:]):
+        assert test_client.put("/cars/{0}/spares".format(car_id), json={"spare_ids": batch},
+                               headers=JSON_HEADERS).status_code == 204
+    etag = test_client.get("/cars/{0}".format(car_id), headers=JSON_HEADERS).headers["ETag"]
+
+    # The car changes after the delete read it, before the first detach commit
+    run_in_transaction = datastore_helper.run_in_transaction
+    writes = []
+
+    def write_then_run(*args):
+        if not writes:
+            car = client.get(client.key("cars", car_id))
+            datastore_helper.bump_version(car)
+            client.put(car)
+            writes.append(car)
+        return run_in_transaction(*args)
+
+    with mock.patch.object(datastore_helper, "run_in_transaction", write_then_run):
+        response = test_client.delete("/cars/{0}".format(car_id), headers=dict(JSON_HEADERS, **{"If-Match": etag}))
+    assert response.status_code == 412
+
+    assert spare_stats(test_client)["installed"]["count"] == len(spare_ids)
+    for spare in client.get_multi([client.key("spares", spare_id) for spare_id in spare_ids]):
+        assert spare["car_id"] == car_id
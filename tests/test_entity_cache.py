@@ -0,0 +1,49 @@
+import time
+from unittest import mock
+
+from google.cloud import datastore
+
+from cache.entity_cache import EntityCache, LocalSharedCache
+from cache.lru_cache import LruCache
+from storage.memory_backend import MemoryClient
+
+
+def make_cache(client, shared, ttl=30):
+    return EntityCache(client, LruCache(100, ttl=ttl), shared, ttl=ttl)
+
+
+def put_car(client):
+    car = datastore.Entity(key=client.key("cars", 1), exclude_from_indexes=("color",))
+    car.update({"name": "car", "color": "red", "price": 1.5, "spare_id": None, "version": 3})
+    client.put(car)
+    return car
+
+
+def test_shared_tier_round_trips_entities_as_protobuf():
+    client = MemoryClient()
+    car = put_car(client)
+    shared = LocalSharedCache(100)
+    make_cache(client, shared).get(car.key)
+
+    data = shared.get(EntityCache.cache_key(car.key))
+    assert isinstance(data, bytes) and not data.startswith(b"\x80")  # not a pickle
+
+    # Another instance reads the entity from the shared tier
+    with mock.patch.object(client, "get", side_effect=AssertionError("read from Datastore")):
+        entity = make_cache(client, shared).get(car.key)
+    assert entity == car
+    assert entity.key == car.key
+    assert entity.exclude_from_indexes == {"color"}
+
+
+def test_shared_tier_entries_expire_after_the_ttl():
+    client = MemoryClient()
+    car = put_car(client)
+    shared = mock.Mock(wraps=LocalSharedCache(100))
+    cache = EntityCache(client, LruCache(100, ttl=0.05), shared, ttl=0.05)
+
+    cache.get(car.key)
+    shared.set.assert_called_once_with(EntityCache.cache_key(car.key), mock.ANY, ex=0.05)
+
+    time.sleep(0.1)
+    assert shared.get(EntityCache.cache_key(car.key)) is None
@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+
+from auth import auth_helper
+from auth.auth_helper import AuthError
+from auth.jwks_store import JwksStore, JwksUnavailableError
+
+
+def make_key(kid):
+    return {"kty": "RSA", "kid": kid, "use": "sig", "n": "n-" + kid, "e": "AQAB"}
+
+
+class StubJwks:
+    # Local JWKS endpoint. Serves keys, or fails with status when it is set.
+    # delay holds every response back, like a slow identity provider.
+
+    def __init__(self):
+        self.keys = [make_key("key-1")]
+        self.status = 200
+        self.delay = 0
+        self.requests = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.delay)
+                body = json.dumps({"keys": stub.keys}).encode()
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{0}/.well-known/jwks.json".format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    stub = StubJwks()
+    yield stub
+    stub.close()
+
+
+def make_store(stub, ttl=600, min_refresh_interval=30):
+    return JwksStore(stub.url, ttl=ttl, fetch_timeout=2, min_refresh_interval=min_refresh_interval)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_keys_are_served_from_memory(stub):
+    store = make_store(stub)
+
+    assert store.get_key("key-1") == make_key("key-1")
+    assert store.get_key("key-1") == make_key("key-1")
+    assert stub.requests == 1
+
+
+def test_expired_keys_are_refreshed_in_the_background(stub):
+    store = make_store(stub, ttl=0.05, min_refresh_interval=0)
+    store.get_key("key-1")
+    stub.keys = [make_key("key-2")]
+    time.sleep(0.1)
+
+    # The expired keys are still served while the refresh runs
+    assert store.get_key("key-1") == make_key("key-1")
+    assert wait_for(lambda: stub.requests == 2 and not store._refreshing)
+    assert store._keys == {"key-2": make_key("key-2")}
+
+
+def test_unknown_kid_forces_one_refresh(stub):
+    store = make_store(stub, min_refresh_interval=0)
+    store.get_key("key-1")
+    stub.keys = [make_key("key-1"), make_key("key-2")]
+
+    assert store.get_key("key-2") == make_key("key-2")
+    assert stub.requests == 2
+
+
+def test_unknown_kid_refreshes_are_rate_limited(stub):
+    store = make_store(stub, min_refresh_interval=30)
+    store.get_key("key-1")
+    store._last_attempt -= 60
+
+    assert store.get_key("missing") is None
+    assert store.get_key("missing") is None
+    assert stub.requests == 2
+
+
+def test_failed_refresh_serves_stale_keys(stub):
+    store = make_store(stub, ttl=0.05, min_refresh_interval=0)
+    store.get_key("key-1")
+    stub.status = 500
+    time.sleep(0.1)
+
+    assert store.get_key("key-1") == make_key("key-1")
+    assert wait_for(lambda: stub.requests == 2 and not store._refreshing)
+    # A forced refresh for an unknown kid fails as well
+    store.ttl = 600
+    assert store.get_key("key-2") is None
+    assert stub.requests == 3
+    assert store.get_key("key-1") == make_key("key-1")
+
+
+def test_cold_store_that_cannot_fetch_answers_503(stub):
+    stub.status = 500
+    store = make_store(stub)
+
+    with mock.patch.object(auth_helper, "jwks_store", store):
+        with pytest.raises(AuthError) as error:
+            auth_helper.get_rsa_key({"kid": "key-1"})
+    assert error.value.status_code == 503
+
+
+def test_cold_store_fetches_at_most_once_per_interval(stub):
+    stub.status = 500
+    store = make_store(stub, min_refresh_interval=30)
+
+    for _ in range(3):
+        with pytest.raises(Exception):
+            store.get_key("key-1")
+    assert stub.requests == 1
+
+    # Once the interval has passed the store tries again and recovers
+    stub.status = 200
+    store._last_attempt -= 60
+    assert store.get_key("key-1") == make_key("key-1")
+    assert stub.requests == 2
+
+
+def test_cold_store_waits_for_a_fetch_that_is_running(stub):
+    stub.delay = 0.5
+    store = make_store(stub)
+    fetcher = threading.Thread(target=store.get_key, args=("key-1",))
+    fetcher.start()
+    assert wait_for(lambda: stub.requests == 1)
+
+    assert store.get_key("key-1") == make_key("key-1")
+    fetcher.join()
+    assert stub.requests == 1
+
+
+def test_cold_store_waiters_fail_fast_after_the_fetch_failed(stub):
+    stub.delay = 0.5
+    stub.status = 500
+    store = make_store(stub)
+    fetcher = threading.Thread(target=lambda: pytest.raises(Exception, store.get_key, "key-1"))
+    fetcher.start()
+    assert wait_for(lambda: stub.requests == 1)
+
+    # The waiter shares the failed fetch instead of running its own
+    with pytest.raises(JwksUnavailableError):
+        store.get_key("key-1")
+    fetcher.join()
+    assert stub.requests == 1
@@ -0,0 +1,80 @@
+import multiprocessing
+import sqlite3
+import threading
+from unittest import mock
+
+import pytest
+from google.api_core import exceptions
+from google.cloud import datastore
+
+from constants import constants
+from service import datastore_helper
+from storage.sqlite_backend import SqliteClient
+
+
+def allocate(path, count, queue):
+    client = SqliteClient(path)
+    ids = []
+    for _ in range(count):
+        spare = datastore.Entity(key=client.key("spares"))
+        spare["name"] = "spare"
+        client.put(spare)
+        ids.append(spare.key.id)
+    ids += [key.id for key in client.allocate_ids(client.key("spares"), count)]
+    queue.put(ids)
+
+
+def test_processes_sharing_a_file_get_distinct_ids(tmp_path):
+    path = str(tmp_path / "local.db")
+    SqliteClient(path)
+
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=allocate, args=(path, 50, queue)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    ids = [id_ for _ in processes for id_ in queue.get(timeout=30)]
+    for process in processes:
+        process.join()
+
+    assert len(ids) == len(set(ids)) == 400
+    client = SqliteClient(path)
+    assert len(list(client.query(kind="spares").fetch())) == 200
+
+
+def test_ids_continue_after_the_largest_stored_id(tmp_path):
+    path = str(tmp_path / "local.db")
+    client = SqliteClient(path)
+    client.put(datastore.Entity(key=client.key("cars", 41)))
+
+    # A file written before the id counter existed
+    connection = sqlite3.connect(path)
+    connection.execute("DROP TABLE id_sequence")
+    connection.commit()
+    connection.close()
+
+    client = SqliteClient(path)
+    assert client.allocate_ids(client.key("cars"), 2)[0].id == 42
+    assert SqliteClient(path).next_id() == 44
+
+
+def test_locked_file_aborts_and_the_transaction_is_retried(tmp_path):
+    path = str(tmp_path / "local.db")
+    client = SqliteClient(path, timeout=0.05)
+    car = datastore.Entity(key=client.key("cars", 1))
+    car["name"] = "car"
+
+    # Another process holds the write lock
+    other = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    with pytest.raises(exceptions.Aborted):
+        client.put(car)
+
+    def put_car():
+        client.get(car.key)
+        client.put(car)
+
+    # The lock is released before the retries run out
+    threading.Timer(0.1, other.execute, args=("COMMIT",)).start()
+    with mock.patch.object(constants, "transaction_retry_delay", 0.1):
+        datastore_helper.run_in_transaction(client, put_car)
+    assert client.get(car.key)["name"] == "car"